@@ -1,16 +1,40 @@
 import os
 import asyncio
+import random
+import time
+import shutil
+import tempfile
+import uuid
 import aiohttp
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime
-from config import SD_API_URL, STYLES
+from config import (SD_API_URL, STYLES, SD_MAX_CONCURRENCY, SD_JOB_CONCURRENCY,
+                    SD_BATCH_MODE, SD_BATCH_SIZE, SD_HEALTH_PATH, SD_HEALTH_CHECK_INTERVAL,
+                    SD_HEALTH_TIMEOUT, SD_EJECT_AFTER_FAILURES, SD_LATENCY_SMOOTHING,
+                    FFMPEG_BINARY, TEMP_DIR, OUTPUT_DIR, VIDEO_FPS, INTERPOLATION_FRAMES,
+                    QUALITY_PROFILES, QUALITY_DEFAULT_PROFILE, SD_RETRY_ATTEMPTS, SD_RETRY_BASE_DELAY,
+                    SD_RETRY_MAX_DELAY, SD_REQUEST_TIMEOUT, SD_GENERATION_DEADLINE, SD_HEDGE_ENABLED,
+                    SD_HEDGE_PERCENTILE, SD_HEDGE_MIN_SAMPLES, SD_HEDGE_MIN_DELAY, SD_HEDGE_MAX_IN_FLIGHT,
+                    FRAME_PIPELINE_WINDOW, CHECKPOINT_DIR, VIDEO_ENCODING_PROFILES, VIDEO_ENCODING_PROFILE,
+                    VIDEO_SHORT_CLIP_PROFILE, VIDEO_SHORT_CLIP_SECONDS)
 from aiogram import Bot
-import imageio
-import subprocess
 import base64
+import json
 from io import BytesIO
 from typing import Optional, Callable, Awaitable
 
-from moviepy.editor import ImageSequenceClip, AudioFileClip
+import numpy as np
+from PIL import Image, ImageOps
+
+try:
+    import orjson  # Необязательно: быстрее разбирает ответы SD с кадрами в base64
+except ImportError:
+    orjson = None
+
+import http_client
+from metrics import (registry, STAGE_SECONDS, SD_REQUEST_SECONDS, FRAMES_TOTAL, SD_IN_FLIGHT, SD_BACKEND_HEALTHY,
+                     SD_RETRIES_TOTAL, SD_HEDGES_TOTAL, VIDEO_OUTPUT_BYTES)
 
 # Оптимизированные параметры
 FRAME_COUNT = 8  # Было 12 → стало 8 (меньше кадров = быстрее)
@@ -19,42 +43,439 @@ IMAGE_HEIGHT = 256
 SD_STEPS = 10  # Было 20 → стало 15 (меньше шагов = быстрее)
 SD_DENOISING_STRENGTH = 0.5  # Было 0.5-0.6 → теперь фиксированное 0.5
 
+# Кодирование по умолчанию: libx264 (как раньше), но с faststart для воспроизведения в Telegram до полной загрузки
+ENCODING_DEFAULTS = {
+    "format": "mp4", "send_as": "video", "crf": 23, "preset": "medium", "pix_fmt": "yuv420p",
+    "tune": None, "faststart": True, "max_bytes": None, "quality": 75,
+}
+
+
+def quality_profile(name: Optional[str] = None) -> dict:
+    """Параметры профиля качества: значения выше, переопределённые QUALITY_PROFILES[name]"""
+    name = name or QUALITY_DEFAULT_PROFILE
+    if name not in QUALITY_PROFILES:
+        raise Exception(f"Профиль качества '{name}' не найден в конфигурации")
+    profile = {"name": name, "frames": FRAME_COUNT, "steps": SD_STEPS, "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT}
+    profile.update(QUALITY_PROFILES[name])
+    return profile
+
+
+def encoding_profile(name: Optional[str] = None) -> dict:
+    """Параметры кодирования: ENCODING_DEFAULTS, переопределённые VIDEO_ENCODING_PROFILES[name]"""
+    name = name or VIDEO_ENCODING_PROFILE
+    if name not in VIDEO_ENCODING_PROFILES:
+        raise Exception(f"Профиль кодирования '{name}' не найден в конфигурации")
+    encoding = dict(ENCODING_DEFAULTS, name=name)
+    encoding.update(VIDEO_ENCODING_PROFILES[name])
+    return encoding
+
+
+def clip_seconds(profile: dict) -> float:
+    """Длительность клипа профиля качества с учётом промежуточных кадров"""
+    frames = profile["frames"] + max(0, profile["frames"] - 1) * INTERPOLATION_FRAMES
+    return frames / VIDEO_FPS
+
+
+def select_encoding(profile: Optional[dict] = None) -> dict:
+    """Профиль кодирования для профиля качества: его ключ "encoding", для коротких клипов —
+    VIDEO_SHORT_CLIP_PROFILE, иначе VIDEO_ENCODING_PROFILE"""
+    profile = profile or quality_profile()
+    name = profile.get("encoding")
+    if not name and VIDEO_SHORT_CLIP_PROFILE and clip_seconds(profile) <= VIDEO_SHORT_CLIP_SECONDS:
+        name = VIDEO_SHORT_CLIP_PROFILE
+    return encoding_profile(name)
+
+
+def frame_params(profile: Optional[dict] = None) -> dict:
+    """Параметры, от которых зависят кадры SD (ключ контрольной точки)"""
+    profile = profile or quality_profile()
+    return {
+        "frames": profile["frames"],
+        "width": profile["width"],
+        "height": profile["height"],
+        "steps": profile["steps"],
+        "denoising": SD_DENOISING_STRENGTH,
+        "batch": SD_BATCH_SIZE if SD_BATCH_MODE else 1,
+    }
+
+
+def generation_params(profile: Optional[dict] = None) -> dict:
+    """Параметры, от которых зависит результат (входят в ключ кэша): кадры SD и сборка видео из них"""
+    profile = profile or quality_profile()
+    return dict(
+        frame_params(profile),
+        fps=VIDEO_FPS,
+        interpolation=INTERPOLATION_FRAMES,
+        encoding=select_encoding(profile)["name"],
+    )
+
+
+# Общий лимит одновременных запросов к SD для всех задач бота
+_sd_semaphore = asyncio.Semaphore(SD_MAX_CONCURRENCY)
+
+
+class SDBackendError(Exception):
+    """Ошибка на стороне сервера SD (сеть, таймаут, 5xx) — повод снизить доверие к узлу"""
+
+
+class SDBackend:
+    """Один сервер Stable Diffusion из пула"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.in_flight = 0
+        self.latency = None  # Скользящее среднее времени ответа (сек)
+        self.failures = 0  # Ошибок подряд
+        self.healthy = True
+
+    def score(self) -> float:
+        # Чем больше запросов в работе и чем медленнее узел, тем он хуже
+        return (self.in_flight + 1) * (self.latency or 1.0)
+
+    def __repr__(self):
+        return f"<SDBackend(url='{self.url}', in_flight={self.in_flight}, healthy={self.healthy})>"
+
+
+class SDBackendPool:
+    """Балансировщик запросов между серверами SD.
+
+    Каждый запрос уходит на наименее загруженный здоровый узел (по числу запросов
+    в работе и скользящему времени ответа). После SD_EJECT_AFTER_FAILURES ошибок
+    подряд узел исключается из пула; фоновая проверка здоровья возвращает его,
+    как только он снова отвечает на SD_HEALTH_PATH.
+    """
+
+    def __init__(self, urls: list):
+        if not urls:
+            raise Exception("Не задан ни один сервер SD (SD_API_URL)")
+        self.backends = [SDBackend(url) for url in urls]
+        self.unit_latency = None  # Скользящее время (сек) на единицу работы по всем узлам
+        self.unit_samples = deque(maxlen=200)  # Последние замеры для перцентилей (хеджирование)
+        self._health_task = None
+
+    def healthy_count(self) -> int:
+        return sum(1 for backend in self.backends if backend.healthy)
+
+    def pick(self, exclude: tuple = ()) -> SDBackend:
+        """Наименее загруженный здоровый узел; узлы из exclude — только если других нет"""
+        healthy = [backend for backend in self.backends if backend.healthy]
+        if not healthy:
+            raise SDBackendError("Нет доступных серверов SD")
+        preferred = [backend for backend in healthy if backend.url not in exclude] or healthy
+        return min(preferred, key=lambda backend: backend.score())
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        """Перцентиль времени на единицу работы по последним запросам"""
+        if not self.unit_samples:
+            return None
+        samples = sorted(self.unit_samples)
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+    @asynccontextmanager
+    async def acquire(self, cost: float = 1.0, exclude: tuple = (), count_timeouts: bool = True):
+        """Выбор узла на время одного запроса с учётом задержки и ошибок.
+
+        cost — объём работы запроса (см. request_cost), по нему считается
+        время на единицу работы для оценки длительности задач.
+        count_timeouts=False — запросу дали меньше SD_REQUEST_TIMEOUT (кончается
+        срок всей задачи), и его таймаут не считается ошибкой узла.
+        """
+        backend = self.pick(exclude)
+        backend.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield backend
+        except asyncio.TimeoutError:
+            if count_timeouts:
+                self.record_failure(backend)
+            SD_REQUEST_SECONDS.observe(time.monotonic() - started, backend=backend.url,
+                                       outcome="error" if count_timeouts else "deadline")
+            raise
+        except (aiohttp.ClientError, SDBackendError):
+            self.record_failure(backend)
+            SD_REQUEST_SECONDS.observe(time.monotonic() - started, backend=backend.url, outcome="error")
+            raise
+        else:
+            elapsed = time.monotonic() - started
+            self.record_success(backend, elapsed)
+            self.record_unit_latency(elapsed / max(cost, 1e-6))
+            SD_REQUEST_SECONDS.observe(elapsed, backend=backend.url, outcome="ok")
+        finally:
+            backend.in_flight -= 1
+
+    def record_success(self, backend: SDBackend, elapsed: Optional[float] = None):
+        backend.failures = 0
+        if elapsed is not None:
+            if backend.latency is None:
+                backend.latency = elapsed
+            else:
+                backend.latency += SD_LATENCY_SMOOTHING * (elapsed - backend.latency)
+        if not backend.healthy:
+            backend.healthy = True
+            print(f"✅ Сервер SD {backend.url} снова в пуле")
+
+    def record_unit_latency(self, seconds: float):
+        self.unit_samples.append(seconds)
+        if self.unit_latency is None:
+            self.unit_latency = seconds
+        else:
+            self.unit_latency += SD_LATENCY_SMOOTHING * (seconds - self.unit_latency)
+
+    def record_failure(self, backend: SDBackend):
+        backend.failures += 1
+        if backend.healthy and backend.failures >= SD_EJECT_AFTER_FAILURES:
+            backend.healthy = False
+            print(f"⚠️ Сервер SD {backend.url} исключён из пула после {backend.failures} ошибок")
+
+    async def check_health(self):
+        """Проверка всех узлов пула"""
+        async def probe(backend: SDBackend):
+            try:
+                async with http_client.sd_session(backend.url).get(f"{backend.url}{SD_HEALTH_PATH}",
+                                       timeout=aiohttp.ClientTimeout(total=SD_HEALTH_TIMEOUT)) as resp:
+                    if resp.status != 200:
+                        raise SDBackendError(f"Health check: {resp.status}")
+                self.record_success(backend)
+            except Exception:
+                self.record_failure(backend)
+
+        await asyncio.gather(*(probe(backend) for backend in self.backends))
+
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.check_health()
+            except Exception as e:
+                print(f"Ошибка проверки серверов SD: {e}")
+            await asyncio.sleep(SD_HEALTH_CHECK_INTERVAL)
+
+    async def collect_metrics(self):
+        for backend in self.backends:
+            SD_IN_FLIGHT.set(backend.in_flight, backend=backend.url)
+            SD_BACKEND_HEALTHY.set(1 if backend.healthy else 0, backend=backend.url)
+
+    def start(self):
+        if self._health_task is None:
+            registry.add_collector(self.collect_metrics)
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
 
-async def generate_sd_frame(session: aiohttp.ClientSession, input_path: str, style: str, frame_num: int):
+
+def parse_backend_urls(value) -> list:
+    """SD_API_URL может быть строкой, строкой через запятую или списком"""
+    if isinstance(value, str):
+        value = value.split(",")
+    return [url.strip() for url in value if url and url.strip()]
+
+
+sd_pool = SDBackendPool(parse_backend_urls(SD_API_URL))
+
+
+
+async def download_photo(bot: Bot, file_id: str) -> bytes:
+    """Скачивание фото из Telegram в память через общую сессию"""
     try:
-        with open(input_path, "rb") as image_file:
-            img_base64 = base64.b64encode(image_file.read()).decode('utf-8')
-
-        # Проверяем, что стиль существует в конфиге
-        if style not in STYLES:
-            raise Exception(f"Стиль '{style}' не найден в конфигурации")
-
-        params = {
-            "init_images": [img_base64],
-            "prompt": f"{STYLES[style]}, frame {frame_num}",
-            "negative_prompt": "blurry, lowres, bad anatomy, ugly, text, watermark",
-            "steps": SD_STEPS,
-            "denoising_strength": SD_DENOISING_STRENGTH,
-            "width": IMAGE_WIDTH,
-            "height": IMAGE_HEIGHT,
-            "cfg_scale": 7,  # Добавляем параметр для контроля креативности
-        }
-
-        async with session.post(
-                f"{SD_API_URL}/sdapi/v1/img2img",
+        with STAGE_SECONDS.time(stage="telegram_get_file"):
+            file = await bot.get_file(file_id)
+        file_url = http_client.telegram_file_url(bot.token, file.file_path)
+
+        buffer = BytesIO()
+        with STAGE_SECONDS.time(stage="telegram_download"):
+            async with http_client.telegram_session().get(file_url) as resp:
+                if resp.status != 200:
+                    raise Exception(f"Ошибка загрузки фото: {resp.status}")
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    buffer.write(chunk)
+        return buffer.getvalue()
+    except Exception as e:
+        raise Exception(f"Ошибка загрузки фото: {str(e)}")
+
+
+def encode_input_image(data: bytes, width: int = IMAGE_WIDTH, height: int = IMAGE_HEIGHT) -> str:
+    """Подготовка фото для SD: поворот по EXIF, кадрирование до нужного размера, base64"""
+    try:
+        image = Image.open(BytesIO(data))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=95)
+        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+    except Exception as e:
+        raise Exception(f"Не удалось обработать фото: {str(e)}")
+
+
+async def prepare_input(bot: Bot, file_id: str, width: int = IMAGE_WIDTH, height: int = IMAGE_HEIGHT) -> str:
+    """Скачивание и подготовка фото один раз на задачу (без файлов на диске)"""
+    data = await download_photo(bot, file_id)
+    with STAGE_SECONDS.time(stage="input_prepare"):
+        return await asyncio.to_thread(encode_input_image, data, width, height)
+
+
+def request_cost(steps: int, width: int, height: int, images: int = 1) -> float:
+    """Объём работы запроса img2img: шаги × кадры × площадь относительно 256×256"""
+    return steps * images * (width * height) / (256 * 256)
+
+
+def build_sd_params(img_base64: str, style: str, prompt: str, seed: int, batch_size: int = 1,
+                    profile: Optional[dict] = None) -> dict:
+    """Параметры запроса img2img"""
+    # Проверяем, что стиль существует в конфиге
+    if style not in STYLES:
+        raise Exception(f"Стиль '{style}' не найден в конфигурации")
+    profile = profile or quality_profile()
+
+    return {
+        "init_images": [img_base64],
+        "prompt": prompt,
+        "negative_prompt": "blurry, lowres, bad anatomy, ugly, text, watermark",
+        "steps": profile["steps"],
+        "denoising_strength": SD_DENOISING_STRENGTH,
+        "width": profile["width"],
+        "height": profile["height"],
+        "cfg_scale": 7,  # Добавляем параметр для контроля креативности
+        "seed": seed,  # Кадры внутри пачки получают seed, seed+1, ...
+        "batch_size": batch_size,
+        "n_iter": 1,
+    }
+
+
+def parse_json(data: bytes):
+    """Разбор JSON из байтов ответа без промежуточной строки (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class SDRequestError(Exception):
+    """Ошибка запроса, которую нет смысла повторять (4xx, пустой ответ)"""
+
+
+# Сетевые ошибки, таймауты и 5xx — повторяем с паузой
+TRANSIENT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, SDBackendError)
+
+# Сколько хеджированных (дублирующих) запросов сейчас в работе на весь бот
+_hedges_in_flight = 0
+
+
+async def _img2img_once(params: dict, cost: float, timeout: float, used: list) -> list:
+    """Одна попытка запроса к SD; адрес выбранного узла добавляется в used"""
+    async with sd_pool.acquire(cost, exclude=tuple(used), count_timeouts=timeout >= SD_REQUEST_TIMEOUT) as backend:
+        used.append(backend.url)
+        async with http_client.sd_session(backend.url).post(
+                f"{backend.url}/sdapi/v1/img2img",
                 json=params,
                 headers={"Content-Type": "application/json"},
-                timeout=300  # Увеличиваем таймаут для обработки
+                timeout=aiohttp.ClientTimeout(total=timeout)
         ) as resp:
             if resp.status != 200:
                 error = await resp.text()
-                raise Exception(f"API Error {resp.status}: {error}")
+                if resp.status >= 500:
+                    raise SDBackendError(f"API Error {resp.status}: {error}")
+                raise SDRequestError(f"API Error {resp.status}: {error}")
 
-            response = await resp.json()
+            response = parse_json(await resp.read())
             if 'images' not in response or not response['images']:
-                raise Exception("Нет изображений в ответе от SD API")
+                raise SDRequestError("Нет изображений в ответе от SD API")
+
+            return response['images']
+
+
+def _hedge_delay(cost: float) -> Optional[float]:
+    """Через сколько секунд дублировать запрос на другой узел (None — не дублировать)"""
+    if not SD_HEDGE_ENABLED or sd_pool.healthy_count() < 2 or _hedges_in_flight >= SD_HEDGE_MAX_IN_FLIGHT:
+        return None
+    if len(sd_pool.unit_samples) < SD_HEDGE_MIN_SAMPLES:
+        return None
+    return max(SD_HEDGE_MIN_DELAY, sd_pool.latency_percentile(SD_HEDGE_PERCENTILE) * cost)
+
+
+async def _hedged_img2img(params: dict, cost: float, timeout: float, used: list) -> list:
+    """Запрос с хеджированием: если ответа нет дольше p95, тот же запрос (с тем же seed)
+    уходит на другой узел; берётся первый успешный ответ, второй запрос отменяется.
+    """
+    global _hedges_in_flight
+    primary = asyncio.create_task(_img2img_once(params, cost, timeout, used))
+    delay = _hedge_delay(cost)
+    if delay is None or delay >= timeout:
+        return await primary
 
-            return response['images'][0]
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+    except BaseException:
+        # Вызывающего отменили, пока ждали: запрос не должен остаться работать без хозяина
+        primary.cancel()
+        raise
+    if done or _hedge_delay(cost) is None:
+        return await primary
+
+    SD_HEDGES_TOTAL.inc(outcome="fired")
+    _hedges_in_flight += 1
+    hedge = asyncio.create_task(_img2img_once(params, cost, timeout - delay, used))
+    pending = {primary, hedge}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    SD_HEDGES_TOTAL.inc(outcome="won" if task is hedge else "lost")
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        _hedges_in_flight -= 1
+        # Проигравший запрос отменяем: соединение закрывается, слот узла освобождается
+        for task in (primary, hedge):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(primary, hedge, return_exceptions=True)
+
+
+async def request_img2img(params: dict, deadline: Optional[float] = None) -> list:
+    """Запрос к наименее загруженному серверу SD, возвращает список изображений в base64.
+
+    Сетевые ошибки, таймауты и 5xx повторяются до SD_RETRY_ATTEMPTS раз с
+    экспоненциальной паузой и случайным разбросом, по возможности на другом узле.
+    Каждая попытка ограничена SD_REQUEST_TIMEOUT и не выходит за deadline
+    (время цикла событий, к которому задача должна получить кадры).
+    """
+    cost = request_cost(params["steps"], params["width"], params["height"], params.get("batch_size", 1))
+    loop = asyncio.get_running_loop()
+    used = []
+    for attempt in range(1, SD_RETRY_ATTEMPTS + 1):
+        timeout = SD_REQUEST_TIMEOUT
+        if deadline is not None:
+            timeout = min(timeout, deadline - loop.time())
+            if timeout <= 0:
+                raise SDBackendError("Истекло время на генерацию кадров")
+        try:
+            return await _hedged_img2img(params, cost, timeout, used)
+        except TRANSIENT_ERRORS as e:
+            if attempt == SD_RETRY_ATTEMPTS:
+                raise
+            delay = random.uniform(0, min(SD_RETRY_MAX_DELAY, SD_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            if deadline is not None and loop.time() + delay >= deadline:
+                raise
+            SD_RETRIES_TOTAL.inc(reason=type(e).__name__)
+            print(f"🔁 Повтор запроса к SD через {delay:.1f} сек (попытка {attempt + 1}): {e!r}")
+            await asyncio.sleep(delay)
+            # Следующая попытка — на другом узле, если он есть
+            used = used[-1:]
+
+
+async def generate_sd_frame(img_base64: str, style: str, frame_num: int,
+                            seed: int = -1, profile: Optional[dict] = None, deadline: Optional[float] = None):
+    try:
+        params = build_sd_params(img_base64, style, f"{STYLES.get(style)}, frame {frame_num}", seed,
+                                 profile=profile)
+        images = await request_img2img(params, deadline)
+        return images[0]
 
     except aiohttp.ClientError as e:
         raise Exception(f"Сетевая ошибка при генерации кадра: {str(e)}")
@@ -62,134 +483,583 @@ async def generate_sd_frame(session: aiohttp.ClientSession, input_path: str, sty
         raise Exception(f"Ошибка генерации кадра {frame_num}: {str(e)}")
 
 
+async def generate_sd_batch(img_base64: str, style: str, first_frame: int,
+                            count: int, seed: int, profile: Optional[dict] = None,
+                            deadline: Optional[float] = None) -> list:
+    """Генерация нескольких кадров одним запросом (batch_size)"""
+    try:
+        params = build_sd_params(img_base64, style, STYLES.get(style), seed, batch_size=count, profile=profile)
+        images = await request_img2img(params, deadline)
+        # Некоторые сборки WebUI добавляют в ответ сетку-превью перед кадрами
+        if len(images) > count:
+            images = images[-count:]
+        if len(images) < count:
+            raise Exception(f"SD API вернул {len(images)} изображений вместо {count}")
+        return images
+
+    except aiohttp.ClientError as e:
+        raise Exception(f"Сетевая ошибка при генерации кадров: {str(e)}")
+    except Exception as e:
+        raise Exception(f"Ошибка генерации кадров {first_frame}-{first_frame + count - 1}: {str(e)}")
+
+
+async def generate_frames_concurrently(img_base64: str, style: str,
+                                       on_frame: Optional[Callable[[int], Awaitable[None]]] = None,
+                                       frame_sink: Optional["OrderedFrameWriter"] = None,
+                                       profile: Optional[dict] = None,
+                                       checkpoint: Optional["FrameCheckpoint"] = None,
+                                       job_semaphore: Optional[asyncio.Semaphore] = None) -> list:
+    """Параллельная генерация кадров с ограничением нагрузки на SD.
+
+    Кадры запрашиваются одновременно (не больше SD_JOB_CONCURRENCY запросов на задачу
+    и SD_MAX_CONCURRENCY на весь бот) и возвращаются в исходном порядке.
+    job_semaphore — общий лимит задачи, если она генерирует несколько стилей.
+    В режиме SD_BATCH_MODE один запрос генерирует до SD_BATCH_SIZE кадров.
+    on_frame вызывается с числом готовых кадров после каждого завершённого запроса,
+    а frame_sink получает каждый кадр сразу после генерации (или None, если кадр пропущен).
+    С frame_sink кадры не копятся в списке (возвращается пустой список), а запросы
+    не уходят дальше FRAME_PIPELINE_WINDOW кадров вперёд от энкодера — так в памяти
+    задачи одновременно лежит лишь несколько кадров, а не весь ролик.
+    Число кадров и параметры запросов берутся из профиля качества.
+    Неудачные запросы повторяются (см. request_img2img), но все вместе укладываются
+    в SD_GENERATION_DEADLINE с начала генерации.
+    С checkpoint каждый готовый кадр сохраняется на диск, а кадры, сохранённые
+    до перезапуска, читаются оттуда без запросов к SD (seed у них те же).
+    """
+    profile = profile or quality_profile()
+    frame_count = profile["frames"]
+    job_semaphore = job_semaphore or asyncio.Semaphore(SD_JOB_CONCURRENCY)
+    frames = [None] * frame_count
+    completed = 0
+    # Кадр i всегда получает seed base_seed + i, в каком бы режиме он ни генерировался
+    base_seed = checkpoint.base_seed if checkpoint else random.randint(0, 2 ** 31 - frame_count)
+    chunk_size = max(1, SD_BATCH_SIZE) if SD_BATCH_MODE else 1
+    deadline = asyncio.get_running_loop().time() + SD_GENERATION_DEADLINE
+
+    async def worker(first_frame: int, count: int):
+        nonlocal completed
+        chunk = [None] * count
+        if frame_sink:
+            await frame_sink.wait_for_room(first_frame)
+
+        if checkpoint and checkpoint.has(first_frame, count):
+            # Кадры готовы с прошлого запуска — читаем с диска
+            chunk = await asyncio.to_thread(checkpoint.load, first_frame, count)
+            FRAMES_TOTAL.inc(count, outcome="resumed")
+        else:
+            # Сначала лимит задачи, потом общий: ожидающая задача не занимает общие слоты
+            async with job_semaphore:
+                async with _sd_semaphore:
+                    try:
+                        if count == 1:
+                            chunk = [await generate_sd_frame(
+                                img_base64, style, first_frame, base_seed + first_frame, profile, deadline
+                            )]
+                        else:
+                            chunk = await generate_sd_batch(
+                                img_base64, style, first_frame, count, base_seed + first_frame, profile, deadline
+                            )
+                    except Exception as e:
+                        print(f"⚠️ Пропущены кадры {first_frame}-{first_frame + count - 1} из-за ошибки: {e}")
+
+            FRAMES_TOTAL.inc(count, outcome="ok" if chunk[0] is not None else "skipped")
+            if checkpoint and chunk[0] is not None:
+                try:
+                    await asyncio.to_thread(checkpoint.save, first_frame, chunk)
+                except OSError as e:
+                    print(f"⚠️ Не удалось сохранить кадры {first_frame}-{first_frame + count - 1}: {e}")
+
+        # Кодирование идёт уже без слотов SD
+        ok = chunk[0] is not None
+        if frame_sink:
+            for offset in range(count):
+                # Кадр отдаётся энкодеру и больше нигде не хранится
+                frame_data, chunk[offset] = chunk[offset], None
+                await frame_sink.put(first_frame + offset, frame_data)
+        else:
+            frames[first_frame:first_frame + count] = chunk
+
+        if not ok:
+            return
+        completed += count
+        if on_frame:
+            await on_frame(completed)
+
+    tasks = [
+        asyncio.create_task(worker(start, min(chunk_size, frame_count - start)))
+        for start in range(0, frame_count, chunk_size)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # Если упал энкодер, остальные запросы уже не нужны (и ждали бы места в окне вечно)
+        for task in tasks:
+            task.cancel()
+    return [frame for frame in frames if frame is not None]
+
+
 async def generate_frames(photo_file: str, style: str, bot: Bot,
                           progress_callback: Optional[Callable[[int, int], Awaitable[None]]] = None):
     """Генерация кадров с улучшенной обработкой ошибок"""
-    temp_dir = "temp"
-    os.makedirs(temp_dir, exist_ok=True)
-    input_path = os.path.join(temp_dir, f"input_{photo_file}.jpg")
+    # Скачиваем и подготавливаем фото
+    img_base64 = await prepare_input(bot, photo_file)
 
-    try:
-        # Скачиваем фото
+    # Генерация кадров
+    async def on_frame(completed: int):
+        if progress_callback:
+            await progress_callback(completed, FRAME_COUNT)
+
+    frames = await generate_frames_concurrently(img_base64, style, on_frame)
+
+    if len(frames) < FRAME_COUNT // 2:  # Если сгенерировано меньше половины кадров
+        raise Exception(f"Сгенерировано только {len(frames)}/{FRAME_COUNT} кадров")
+
+    return frames
+
+
+def checkpoint_path(task_id: int) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"task_{task_id}")
+
+
+def remove_checkpoint(task_id: int):
+    shutil.rmtree(checkpoint_path(task_id), ignore_errors=True)
+
+
+class FrameCheckpoint:
+    """Готовые кадры задачи на диске, чтобы после перезапуска бота продолжить с места остановки.
+
+    В папке лежат manifest.json (фото, стиль, параметры генерации и base_seed)
+    и кадры frame_0000.png в том виде, в каком их вернул SD. Если задача
+    вернулась с другими параметрами, старые кадры удаляются и всё начинается заново.
+    Методы синхронные (работа с диском) — вызывать через asyncio.to_thread.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.base_seed = None
+        self.frames = set()
+
+    def _frame_path(self, index: int) -> str:
+        return os.path.join(self.path, f"frame_{index:04d}.png")
+
+    def _write(self, path: str, data: bytes):
+        partial = path + ".part"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+
+    def open(self, identity: dict, frame_count: int) -> int:
+        """Загрузить или начать контрольную точку; возвращает число уже готовых кадров"""
+        identity = json.loads(json.dumps(identity))
+        manifest_path = os.path.join(self.path, self.MANIFEST)
+        manifest = None
         try:
-            file = await bot.get_file(photo_file)
-            file_url = f"https://api.telegram.org/file/bot{bot.token}/{file.file_path}"
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(file_url) as resp:
-                    if resp.status != 200:
-                        raise Exception(f"Ошибка загрузки фото: {resp.status}")
-                    with open(input_path, 'wb') as f:
-                        f.write(await resp.read())
-        except Exception as e:
-            raise Exception(f"Ошибка загрузки фото: {str(e)}")
+        if manifest and manifest.get("identity") == identity:
+            self.base_seed = manifest["base_seed"]
+            self.frames = {index for index in range(frame_count) if os.path.exists(self._frame_path(index))}
+            return len(self.frames)
 
-        # Генерация кадров
-        frames = []
-        async with aiohttp.ClientSession() as session:
-            for i in range(FRAME_COUNT):
-                try:
-                    if progress_callback:
-                        await progress_callback(i, FRAME_COUNT)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        self.base_seed = random.randint(0, 2 ** 31 - frame_count)
+        self.frames = set()
+        self._write(manifest_path, json.dumps({"identity": identity, "base_seed": self.base_seed}).encode("utf-8"))
+        return 0
 
-                    frame = await generate_sd_frame(session, input_path, style, i)
-                    frames.append(frame)
-                except Exception as e:
-                    print(f"⚠️ Пропущен кадр {i} из-за ошибки: {e}")
-                    continue
+    def has(self, first_frame: int, count: int) -> bool:
+        return all(index in self.frames for index in range(first_frame, first_frame + count))
 
-        if len(frames) < FRAME_COUNT // 2:  # Если сгенерировано меньше половины кадров
-            raise Exception(f"Сгенерировано только {len(frames)}/{FRAME_COUNT} кадров")
+    def load(self, first_frame: int, count: int) -> list:
+        chunk = []
+        for index in range(first_frame, first_frame + count):
+            with open(self._frame_path(index), "rb") as f:
+                chunk.append(f.read())
+        return chunk
 
-        return frames
+    def save(self, first_frame: int, chunk: list):
+        for offset, frame_data in enumerate(chunk):
+            self._write(self._frame_path(first_frame + offset), base64.b64decode(frame_data))
+            self.frames.add(first_frame + offset)
 
-    finally:
-        if os.path.exists(input_path):
-            try:
-                os.remove(input_path)
-            except:
-                pass
 
+def make_job_dir() -> str:
+    """Отдельная временная папка задачи, чтобы файлы параллельных задач не пересекались"""
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    return tempfile.mkdtemp(prefix="job_", dir=TEMP_DIR)
+
+
+def decode_frame(frame_data, width: int, height: int) -> np.ndarray:
+    """base64 PNG от SD (или байты PNG из контрольной точки) → массив RGB (height, width, 3) нужного размера.
+
+    Строка base64 декодируется сразу в байты PNG, PNG — в буфер Pillow, откуда
+    пиксели один раз копируются в массив NumPy; дальше кадр не копируется
+    (энкодер пишет этот массив в ffmpeg как есть).
+    """
+    with STAGE_SECONDS.time(stage="frame_decode"):
+        if isinstance(frame_data, str):
+            frame_data = base64.b64decode(frame_data)
+        with Image.open(BytesIO(frame_data)) as image:
+            image = image.convert("RGB")
+            if image.size != (width, height):
+                image = image.resize((width, height))
+            return np.asarray(image)
+
+
+class FrameInterpolator:
+    """Промежуточные кадры между двумя RGB-кадрами (плавное смешивание).
+
+    Все кадры считаются одной векторной операцией NumPy; веса идут по кривой
+    smoothstep, чтобы переход замедлялся у кадров SD и не выглядел рывком.
+    Буферы выделяются один раз на видео и переиспользуются для каждой пары кадров.
+    """
 
-async def create_video(frames: list, output_path: str, fps: int = 8):
+    def __init__(self, count: int, width: int, height: int):
+        t = np.arange(1, count + 1, dtype=np.float32) / (count + 1)
+        self._weights = (t * t * (3 - 2 * t)).reshape(count, 1, 1, 1)
+        self._start = np.empty((1, height, width, 3), dtype=np.float32)
+        self._delta = np.empty((1, height, width, 3), dtype=np.float32)
+        self._blend = np.empty((count, height, width, 3), dtype=np.float32)
+        self._frames = np.empty((count, height, width, 3), dtype=np.uint8)
+
+    def __call__(self, previous: np.ndarray, current: np.ndarray) -> np.ndarray:
+        """Возвращает внутренний буфер: он действителен до следующего вызова"""
+        with STAGE_SECONDS.time(stage="interpolate"):
+            self._start[0] = previous
+            np.subtract(current, self._start[0], out=self._delta[0])
+            np.multiply(self._delta, self._weights, out=self._blend)
+            np.add(self._blend, self._start, out=self._blend)
+            np.rint(self._blend, out=self._blend)
+            self._frames[...] = self._blend
+            return self._frames
+
+
+class VideoEncoder:
+    """Кодирование видео через ffmpeg без промежуточных PNG.
+
+    Декодированные кадры пишутся в stdin процесса ffmpeg как rawvideo; ffmpeg
+    работает отдельным процессом, а декодирование кадров — в пуле потоков,
+    поэтому цикл событий бота не блокируется. Файл собирается в папке задачи
+    и переносится в output_path только после успешного завершения.
+    Если interpolate > 0, перед каждым кадром (кроме первого) пишется столько
+    промежуточных кадров между ним и предыдущим. В памяти держится только
+    предыдущий кадр и буферы интерполяции.
+    encoding — профиль кодирования (см. encoding_profile). С max_bytes битрейт
+    ограничивается так, чтобы клип длительностью duration сек уложился в размер;
+    если файл всё равно больше, он один раз пережимается с меньшим битрейтом.
+    """
+
+    def __init__(self, output_path: str, fps: int = 8, width: int = IMAGE_WIDTH, height: int = IMAGE_HEIGHT,
+                 work_dir: Optional[str] = None, interpolate: int = 0, encoding: Optional[dict] = None,
+                 duration: Optional[float] = None):
+        self.output_path = output_path
+        self.fps = fps
+        self.interpolate = interpolate
+        self.width = width
+        self.height = height
+        self.encoding = encoding or encoding_profile()
+        self.duration = duration
+        self.work_dir = work_dir or os.path.dirname(output_path) or "."
+        self.frames_written = 0
+        self._previous = None
+        self._interpolator = FrameInterpolator(interpolate, width, height) if interpolate else None
+        self._partial_path = os.path.join(self.work_dir, f"{os.path.basename(output_path)}.part")
+        self._process = None
+        self._started = None
+
+    async def start(self):
+        self._started = time.perf_counter()
+        self._process = await asyncio.create_subprocess_exec(
+            FFMPEG_BINARY, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", f"{self.width}x{self.height}", "-r", str(self.fps),
+            "-i", "-",
+            "-an", *self._output_args(self._target_bitrate(self.duration)),
+            self._partial_path,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+    def _target_bitrate(self, duration: Optional[float]) -> Optional[int]:
+        """Битрейт (бит/с), при котором клип уложится в max_bytes; 10% — на контейнер"""
+        if not self.encoding["max_bytes"] or not duration or self.encoding["format"] != "mp4":
+            return None
+        return max(int(self.encoding["max_bytes"] * 8 * 0.9 / duration), 16000)
+
+    def _output_args(self, bitrate: Optional[int] = None, average: bool = False) -> list:
+        encoding = self.encoding
+        if encoding["format"] == "webp":
+            return ["-c:v", "libwebp", "-lossless", "0", "-q:v", str(encoding["quality"]), "-loop", "0",
+                    "-f", "webp"]
+        if encoding["format"] != "mp4":
+            raise Exception(f"Неизвестный формат видео: {encoding['format']}")
+
+        args = ["-c:v", "libx264", "-preset", encoding["preset"], "-pix_fmt", encoding["pix_fmt"]]
+        if encoding["tune"]:
+            args += ["-tune", encoding["tune"]]
+        if average:
+            # Пережатие: средний битрейт вместо CRF
+            args += ["-b:v", str(bitrate)]
+        else:
+            args += ["-crf", str(encoding["crf"])]
+        if bitrate:
+            # CRF с потолком: простые сцены остаются мельче лимита, сложные не выходят за него
+            args += ["-maxrate", str(bitrate), "-bufsize", str(bitrate * 2)]
+        if encoding["faststart"]:
+            args += ["-movflags", "+faststart"]
+        return args + ["-f", "mp4"]
+
+    def _frames_total(self) -> int:
+        return self.frames_written + max(0, self.frames_written - 1) * self.interpolate
+
+    async def _shrink(self):
+        """Пережать готовый файл, если он больше max_bytes (профиль с целевым размером)"""
+        size = os.path.getsize(self._partial_path)
+        max_bytes = self.encoding["max_bytes"]
+        bitrate = self._target_bitrate(self._frames_total() / self.fps)
+        if not bitrate or size <= max_bytes:
+            return
+        # Первый проход уже шёл с этим потолком — берём с запасом пропорционально превышению
+        bitrate = max(int(bitrate * max_bytes / size * 0.9), 16000)
+        shrunk_path = f"{self._partial_path}.small"
+        with STAGE_SECONDS.time(stage="encode_shrink"):
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_BINARY, "-y", "-loglevel", "error", "-i", self._partial_path,
+                "-an", *self._output_args(bitrate, average=True), shrunk_path,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await process.communicate()
+        if process.returncode != 0:
+            # Не страшно: отдаём файл первого прохода
+            print(f"Не удалось пережать видео до {max_bytes} байт: {stderr.decode(errors='ignore').strip()}")
+            if os.path.exists(shrunk_path):
+                os.remove(shrunk_path)
+            return
+        if os.path.getsize(shrunk_path) < size:
+            os.replace(shrunk_path, self._partial_path)
+        else:
+            os.remove(shrunk_path)
+
+    async def write_frame(self, frame_data: str):
+        frame = await asyncio.to_thread(decode_frame, frame_data, self.width, self.height)
+        del frame_data
+        # write() забирает данные сразу (в pipe или во внутренний буфер транспорта),
+        # поэтому буфер интерполяции можно переиспользовать для следующей пары
+        if self._interpolator and self._previous is not None:
+            between = await asyncio.to_thread(self._interpolator, self._previous, frame)
+            self._process.stdin.write(memoryview(between).cast("B"))
+        self._process.stdin.write(memoryview(frame).cast("B"))
+        await self._process.stdin.drain()
+        self._previous = frame
+        self.frames_written += 1
+
+    async def finish(self) -> str:
+        self._previous = None
+        with STAGE_SECONDS.time(stage="encode_finalize"):
+            self._process.stdin.close()
+            _, stderr = await self._process.communicate()
+        if self._process.returncode != 0:
+            raise Exception(f"ffmpeg завершился с кодом {self._process.returncode}: "
+                            f"{stderr.decode(errors='ignore').strip()}")
+        await self._shrink()
+        VIDEO_OUTPUT_BYTES.observe(os.path.getsize(self._partial_path), encoding=self.encoding["name"])
+        os.replace(self._partial_path, self.output_path)
+        STAGE_SECONDS.observe(time.perf_counter() - self._started, stage="encode")
+        return self.output_path
+
+    async def abort(self):
+        self._previous = None
+        if self._process and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        for path in (self._partial_path, f"{self._partial_path}.small"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class OrderedFrameWriter:
+    """Стадия конвейера между генерацией и энкодером.
+
+    Кадры приходят в произвольном порядке; writer придерживает те, что пришли
+    раньше своей очереди (в сжатом виде, как их отдал SD), и отдаёт энкодеру
+    строго по номерам. Пропущенный кадр (None) просто сдвигает очередь дальше.
+    wait_for_room() не даёт генерации уйти дальше window кадров вперёд.
+    """
+
+    def __init__(self, encoder: VideoEncoder,
+                 on_written: Optional[Callable[[int], Awaitable[None]]] = None,
+                 window: int = FRAME_PIPELINE_WINDOW):
+        self.encoder = encoder
+        self.on_written = on_written
+        self.window = max(1, window)
+        self._pending = {}
+        self._next_index = 0
+        self._lock = asyncio.Lock()
+        self._advanced = asyncio.Condition()
+
+    async def wait_for_room(self, index: int):
+        """Ждать, пока кадр index не окажется в пределах окна от следующего кадра для энкодера"""
+        async with self._advanced:
+            await self._advanced.wait_for(lambda: index < self._next_index + self.window)
+
+    async def put(self, index: int, frame_data: Optional[str]):
+        self._pending[index] = frame_data
+        del frame_data
+        async with self._lock:
+            while self._next_index in self._pending:
+                frame_data = self._pending.pop(self._next_index)
+                self._next_index += 1
+                if frame_data is not None:
+                    await self.encoder.write_frame(frame_data)
+                    del frame_data
+                    if self.on_written:
+                        await self.on_written(self.encoder.frames_written)
+                async with self._advanced:
+                    self._advanced.notify_all()
+
+
+async def create_video(frames: list, output_path: str, fps: int = 8, work_dir: Optional[str] = None):
+    encoder = VideoEncoder(output_path, fps=fps, work_dir=work_dir)
     try:
-        # Сохраняем кадры как изображения
-        temp_images = []
-        for i, frame_data in enumerate(frames):
-            img_data = base64.b64decode(frame_data)
-            img_path = f"temp_frame_{i}.png"
-            with open(img_path, 'wb') as f:
-                f.write(img_data)
-            temp_images.append(img_path)
-
-        # Создаем видео
-        clip = ImageSequenceClip(temp_images, fps=fps)
-        clip.write_videofile(output_path, codec="libx264", audio=False)
-
-        # Удаляем временные файлы
-        for img_path in temp_images:
-            os.remove(img_path)
+        await encoder.start()
+        for frame_data in frames:
+            await encoder.write_frame(frame_data)
+        await encoder.finish()
     except Exception as e:
+        await encoder.abort()
         raise Exception(f"Ошибка при создании видео: {str(e)}")
 
-async def generate_ai_video(photo_files: list, style: str, bot: Bot,
-                            progress_callback: Optional[Callable[[int], Awaitable[None]]] = None) -> str:
-    """Финальная функция с прогрессом"""
+async def _render_video(img_base64: Optional[str], style: str, profile: dict, job_dir: str,
+                        update_progress: Callable[..., Awaitable[None]],
+                        checkpoint: Optional[FrameCheckpoint] = None,
+                        job_semaphore: Optional[asyncio.Semaphore] = None) -> str:
+    """Кадры одного стиля → видео в OUTPUT_DIR; прогресс — шагами через update_progress"""
+    # Энкодер запускается сразу: кадры кодируются по мере генерации
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    encoding = select_encoding(profile)
+    video_name = f"video_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{encoding['format']}"
+    video_path = os.path.join(OUTPUT_DIR, video_name)
+    encoder = VideoEncoder(video_path, fps=VIDEO_FPS, width=profile["width"], height=profile["height"],
+                           work_dir=job_dir, interpolate=INTERPOLATION_FRAMES, encoding=encoding,
+                           duration=clip_seconds(profile))
+
+    generated = 0
+
+    async def on_frame(completed: int):
+        nonlocal generated
+        # В пакетном режиме один запрос приносит сразу несколько кадров
+        await update_progress(completed - generated)
+        generated = completed
+
+    async def on_written(written: int):
+        await update_progress()
+
+    try:
+        await encoder.start()
+        writer = OrderedFrameWriter(encoder, on_written, FRAME_PIPELINE_WINDOW)
+
+        # Генерация кадров
+        await generate_frames_concurrently(img_base64, style, on_frame, frame_sink=writer, profile=profile,
+                                           checkpoint=checkpoint, job_semaphore=job_semaphore)
+
+        if not encoder.frames_written:
+            raise Exception("Не удалось сгенерировать ни одного кадра")
+
+        # Создание видео: к этому моменту все кадры уже в ffmpeg
+        await update_progress(0, "finalize")
+        await encoder.finish()
+    except BaseException:
+        await encoder.abort()
+        raise
+    await update_progress(1, "finalize")
+    return video_path
+
+
+async def generate_ai_videos(photo_files: list, styles: list, bot: Bot,
+                             progress_callback: Optional[Callable[[int, str], Awaitable[None]]] = None,
+                             profile_name: Optional[str] = None,
+                             checkpoint_dirs: Optional[list] = None) -> list:
+    """Видео по одному фото сразу в нескольких стилях.
+
+    Фото скачивается и готовится один раз, запросы к SD всех стилей идут
+    вперемешку под общим лимитом SD_JOB_CONCURRENCY — нагрузка на SD как у
+    одной задачи, но без простоев между стилями. Возвращает список той же
+    длины, что styles: путь к mp4 или исключение, если стиль не удался.
+    checkpoint_dirs — папки контрольных точек по стилям (см. generate_ai_video).
+    """
+    profile = quality_profile(profile_name)
+    checkpoint_dirs = checkpoint_dirs or [None] * len(styles)
+    job_dir = make_job_dir()
     try:
-        total_steps = FRAME_COUNT + 1  # +1 для этапа создания видео
+        # Каждый кадр даёт два шага: генерация и кодирование, +1 на сборку mp4
+        total_steps = (profile["frames"] * 2 + 1) * len(styles)
         current_step = 0
 
-        def update_progress():
+        async def update_progress(steps: int = 1, stage: str = "generate"):
             nonlocal current_step
-            current_step += 1
+            current_step += steps
+            # Пока генерируются другие стили, сборку одного не показываем
+            if stage == "finalize" and current_step < total_steps - 1 and len(styles) > 1:
+                stage = "generate"
             if progress_callback:
                 progress = int((current_step / total_steps) * 100)
-                asyncio.create_task(progress_callback(progress))
+                await progress_callback(progress, stage)
 
-        # Генерация кадров
-        frames = []
-        temp_dir = "temp"
-        os.makedirs(temp_dir, exist_ok=True)
-        input_path = os.path.join(temp_dir, f"input_{photo_files[0]}.jpg")
+        await update_progress(0, "prepare")
+        checkpoints = []
+        for style, checkpoint_dir in zip(styles, checkpoint_dirs):
+            checkpoint = None
+            if checkpoint_dir:
+                checkpoint = FrameCheckpoint(checkpoint_dir)
+                # Интерполяция и кодирование на кадры SD не влияют: их смена не сбрасывает готовые кадры
+                identity = {"input": photo_files[0], "style": style, "params": frame_params(profile)}
+                resumed = await asyncio.to_thread(checkpoint.open, identity, profile["frames"])
+                if resumed:
+                    print(f"♻️ Продолжаем с контрольной точки ({style}): готово {resumed}/{profile['frames']} кадров")
+            checkpoints.append(checkpoint)
 
-        # Скачиваем фото
-        try:
-            file = await bot.get_file(photo_files[0])
-            file_url = f"https://api.telegram.org/file/bot{bot.token}/{file.file_path}"
+        # Скачиваем и подготавливаем фото (не нужно, если все кадры уже есть)
+        img_base64 = None
+        if any(not checkpoint or not checkpoint.has(0, profile["frames"]) for checkpoint in checkpoints):
+            img_base64 = await prepare_input(bot, photo_files[0], profile["width"], profile["height"])
+        await update_progress(0)
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(file_url) as resp:
-                    with open(input_path, 'wb') as f:
-                        f.write(await resp.read())
-        except Exception as e:
-            raise Exception(f"Ошибка загрузки фото: {str(e)}")
+        job_semaphore = asyncio.Semaphore(SD_JOB_CONCURRENCY)
+        return await asyncio.gather(*(
+            _render_video(img_base64, style, profile, job_dir, update_progress, checkpoint, job_semaphore)
+            for style, checkpoint in zip(styles, checkpoints)
+        ), return_exceptions=True)
+    finally:
+        # Очистка временных файлов задачи
+        shutil.rmtree(job_dir, ignore_errors=True)
 
-        # Генерация кадров
-        async with aiohttp.ClientSession() as session:
-            for i in range(FRAME_COUNT):
-                try:
-                    frame = await generate_sd_frame(session, input_path, style, i)
-                    frames.append(frame)
-                    update_progress()
-                except Exception as e:
-                    print(f"⚠️ Пропущен кадр {i} из-за ошибки: {e}")
-                    continue
-
-        if not frames:
-            raise Exception("Не удалось сгенерировать ни одного кадра")
 
-        # Создание видео
-        output_dir = "output"
-        os.makedirs(output_dir, exist_ok=True)
-        video_path = os.path.join(output_dir, f"video_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4")
-        await create_video(frames, video_path)
-        update_progress()
+async def generate_ai_video(photo_files: list, style: str, bot: Bot,
+                            progress_callback: Optional[Callable[[int, str], Awaitable[None]]] = None,
+                            profile_name: Optional[str] = None,
+                            checkpoint_dir: Optional[str] = None) -> str:
+    """Финальная функция с прогрессом.
 
-        return video_path
+    progress_callback получает процент и этап: "prepare", "generate" или "finalize".
+    profile_name — профиль качества из QUALITY_PROFILES (по умолчанию QUALITY_DEFAULT_PROFILE).
+    checkpoint_dir — папка контрольной точки задачи (см. FrameCheckpoint): готовые
+    кадры прошлого запуска не генерируются заново, а если готовы все — сразу кодирование.
+    Папку удаляет вызывающий код, когда задача завершена.
+    """
+    try:
+        result, = await generate_ai_videos(photo_files, [style], bot, progress_callback, profile_name,
+                                           [checkpoint_dir])
+        if isinstance(result, BaseException):
+            raise result
+        return result
 
     except Exception as e:
         raise Exception(f"❌ Ошибка: {str(e)}")
-    finally:
-        # Очистка временных файлов
-        if os.path.exists(input_path):
-            os.remove(input_path)
\ No newline at end of file
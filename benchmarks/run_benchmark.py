@@ -0,0 +1,233 @@
+"""Нагрузочный бенчмарк бота без GPU и без настоящего Telegram.
+
+Поднимает заглушки SD и Bot API (stub_servers.py), подменяет БД на SQLite и
+прогоняет через обработчики main.py N пользователей: фото → «Выбрать стиль» →
+кнопка стиля. Выводит jobs/min, p50/p95/p99 времени задачи и задержку цикла событий.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run_benchmark --users 20 --sd-servers 2 --sd-latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+from time import perf_counter, time
+
+from benchmarks.stub_servers import StubSDServer, StubTelegramServer, StubRedisServer
+
+# Валидный по формату токен: aiogram проверяет его при создании Bot
+BENCH_TOKEN = "123456:BENCHMARKTOKENBENCHMARKTOKENBENCHMA"
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class LoopLagMonitor:
+    """Насколько позже запланированного просыпается цикл событий"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+def configure_bot(args, workdir: str, sd_urls: list, telegram_url: str, redis_url: str = None):
+    """Настройка config и окружения до импорта main"""
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    import config
+    config.BOT_TOKEN = BENCH_TOKEN
+    config.SD_API_URL = sd_urls
+    config.TEMP_DIR = os.path.join(workdir, "temp")
+    config.OUTPUT_DIR = os.path.join(workdir, "output")
+    config.CHECKPOINT_DIR = os.path.join(workdir, "checkpoints")
+    config.METRICS_ENABLED = False
+    if args.encoding:
+        config.VIDEO_ENCODING_PROFILE = args.encoding
+    if args.workers:
+        config.QUEUE_WORKERS = args.workers
+    config.QUEUE_POLL_INTERVAL = 0.5
+    if redis_url:
+        config.STATE_BACKEND = "redis"
+        config.STATE_REDIS_URL = redis_url
+
+    import http_client
+    http_client.TELEGRAM_FILE_URL = telegram_url + "/file/bot{token}/{path}"
+
+
+def make_updates(user_index: int, data: str, photo_id: str):
+    chat_id = 100000 + user_index
+    user = {"id": chat_id, "is_bot": False, "first_name": f"user{user_index}"}
+    chat = {"id": chat_id, "type": "private"}
+    now = int(time())
+    base_id = user_index * 10
+    return chat_id, [
+        {"update_id": base_id + 1, "message": {
+            "message_id": 1, "date": now, "chat": chat, "from": user,
+            "photo": [{"file_id": photo_id, "file_unique_id": f"u_{photo_id}", "width": 1280, "height": 960}]
+        }},
+        {"update_id": base_id + 2, "message": {
+            "message_id": 2, "date": now, "chat": chat, "from": user, "text": "🎨 Выбрать стиль и создать видео"
+        }},
+        {"update_id": base_id + 3, "callback_query": {
+            "id": str(base_id + 3), "from": user, "chat_instance": str(chat_id), "data": data,
+            "message": {"message_id": 3, "date": now, "chat": chat, "text": "Выберите стиль обработки:"}
+        }},
+    ]
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    sd_servers = [
+        StubSDServer(latency=args.sd_latency, jitter=args.sd_jitter, error_rate=args.sd_error_rate,
+                     image_size=args.sd_image_size, slots=args.sd_slots)
+        for _ in range(args.sd_servers)
+    ]
+    telegram = StubTelegramServer(photo_size=args.photo_size)
+    redis = StubRedisServer() if args.state_backend == "redis" else None
+    servers = sd_servers + [telegram] + ([redis] if redis else [])
+    for server in servers:
+        await server.start()
+
+    configure_bot(args, workdir, [server.url for server in sd_servers], telegram.url, redis.url if redis else None)
+
+    from aiogram import types
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import main
+
+    main.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(telegram.url))
+    main.engine.sync_engine.echo = False
+    await main.on_startup()
+
+    async def feed(update: dict):
+        await main.dp.feed_update(main.bot, types.Update.model_validate(update, context={"bot": main.bot}))
+
+    latencies, failures, rejections = [], [], []
+    lag = LoopLagMonitor()
+    lag.start()
+
+    async def simulate_user(index: int):
+        await asyncio.sleep(index * args.arrival_interval)
+        style_id = 1 + index % args.styles
+        photo_id = f"photo_{index % args.unique_photos}" if args.unique_photos else f"photo_{index}"
+        data = "styles_all" if args.fanout else f"style_{style_id}"
+        chat_id, updates = make_updates(index, data, photo_id)
+        telegram.callback_chats[updates[-1]["callback_query"]["id"]] = chat_id
+        for update in updates[:-1]:
+            await feed(update)
+
+        started = perf_counter()
+        await feed(updates[-1])
+        try:
+            method, text = await telegram.wait_for_delivery(chat_id, args.timeout)
+        except asyncio.TimeoutError:
+            failures.append("timeout")
+            return
+        if method == "answerCallbackQuery":
+            # Отказ сразу (перегрузка или квота) — не ошибка и не таймаут
+            rejections.append(text)
+        elif method == "sendMessage":
+            failures.append(text)
+        else:
+            latencies.append(perf_counter() - started)
+
+    started = perf_counter()
+    await asyncio.gather(*(simulate_user(i) for i in range(args.users)))
+    wall = perf_counter() - started
+
+    await lag.stop()
+    try:
+        await main.on_shutdown()
+    except Exception as e:
+        print(f"on_shutdown: {e}")
+    for server in servers:
+        await server.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "users": args.users,
+        "completed": len(latencies),
+        "failed": len(failures),
+        "rejected": len(rejections),
+        "wall_seconds": round(wall, 2),
+        "jobs_per_minute": round(len(latencies) / wall * 60, 2) if wall else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p95": round(percentile(latencies, 95), 3),
+        "latency_p99": round(percentile(latencies, 99), 3),
+        "latency_mean": round(statistics.mean(latencies), 3) if latencies else 0.0,
+        "loop_lag_p50_ms": round(percentile(lag.samples, 50) * 1000, 2),
+        "loop_lag_p99_ms": round(percentile(lag.samples, 99) * 1000, 2),
+        "loop_lag_max_ms": round(max(lag.samples, default=0) * 1000, 2),
+        "sd_requests": sum(server.requests for server in sd_servers),
+        "sd_errors": sum(server.errors for server in sd_servers),
+        "sd_max_in_flight": [server.max_in_flight for server in sd_servers],
+        "telegram_calls": dict(telegram.calls),
+        "uploaded_bytes": telegram.uploaded_bytes,
+        "state_commands": dict(redis.commands) if redis else {},
+        "failure_samples": failures[:5],
+        "rejection_samples": rejections[:3],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк бота на заглушках SD и Telegram")
+    parser.add_argument("--users", type=int, default=10, help="Сколько пользователей отправят фото")
+    parser.add_argument("--arrival-interval", type=float, default=0.2, help="Пауза между приходом пользователей (сек)")
+    parser.add_argument("--styles", type=int, default=4, help="Сколько стилей перебирать (id 1..N)")
+    parser.add_argument("--encoding", help="Профиль кодирования из VIDEO_ENCODING_PROFILES (по умолчанию — как в config.py)")
+    parser.add_argument("--fanout", action="store_true", help="Выбирать «Все стили сразу» вместо одного стиля")
+    parser.add_argument("--unique-photos", type=int, default=0,
+                        help="Сколько разных фото (0 — у каждого своё; меньше users — будут повторы)")
+    parser.add_argument("--workers", type=int, default=0, help="QUEUE_WORKERS (0 — как в config.py)")
+    parser.add_argument("--sd-servers", type=int, default=1, help="Сколько заглушек SD поднять")
+    parser.add_argument("--sd-latency", type=float, default=0.5, help="Время одного кадра на заглушке (сек)")
+    parser.add_argument("--sd-jitter", type=float, default=0.2, help="Разброс времени кадра (доля)")
+    parser.add_argument("--sd-error-rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--sd-slots", type=int, default=2, help="Одновременных запросов на одну заглушку")
+    parser.add_argument("--sd-image-size", type=int, default=256, help="Размер кадров, которые отдаёт заглушка")
+    parser.add_argument("--photo-size", type=int, default=1280, help="Ширина исходного фото")
+    parser.add_argument("--state-backend", choices=("memory", "redis"), default="memory",
+                        help="Хранилище состояния; redis — через локальную заглушку протокола Redis")
+    parser.add_argument("--timeout", type=float, default=600, help="Сколько ждать видео одного пользователя (сек)")
+    parser.add_argument("--json", help="Сохранить результат в JSON-файл")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not shutil.which(__import__("config").FFMPEG_BINARY):
+        sys.exit("Для бенчмарка нужен ffmpeg (FFMPEG_BINARY в config.py)")
+
+    result = asyncio.run(run(args))
+    for key, value in result.items():
+        print(f"{key:>20}: {value}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""Локальные заглушки Stable Diffusion API и Telegram Bot API для бенчмарка"""
+import asyncio
+import base64
+import json
+import random
+from collections import defaultdict
+from io import BytesIO
+from time import time
+
+from aiohttp import web
+from PIL import Image
+
+
+def make_png(width: int, height: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class _StubServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.app = web.Application(client_max_size=64 * 1024 ** 2)
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # При port=0 система выбирает свободный порт
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class StubSDServer(_StubServer):
+    """Заглушка /sdapi/v1/img2img.
+
+    latency — среднее время одного кадра (сек), jitter — разброс (доля от latency),
+    error_rate — доля ответов с ошибкой error_status (по умолчанию 500), slots — сколько запросов «GPU» обрабатывает
+    одновременно (остальные ждут), batch_cost — доля времени кадра, которую
+    добавляет каждый следующий кадр пачки. healthy=False — проверка здоровья отвечает 503.
+    """
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.2, error_rate: float = 0.0,
+                 image_size: int = 256, slots: int = 1, batch_cost: float = 0.35, error_status: int = 500,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.image_size = image_size
+        self.batch_cost = batch_cost
+        self._slots = asyncio.Semaphore(slots)
+        self._images = [base64.b64encode(make_png(image_size, image_size, i)).decode() for i in range(16)]
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.healthy = True
+        self.app.router.add_post("/sdapi/v1/img2img", self.img2img)
+        self.app.router.add_get("/internal/ping", self.ping)
+
+    async def ping(self, request: web.Request) -> web.Response:
+        if not self.healthy:
+            return web.Response(status=503, text="stub unhealthy")
+        return web.json_response({})
+
+    async def img2img(self, request: web.Request) -> web.Response:
+        params = await request.json()
+        batch_size = int(params.get("batch_size", 1)) * int(params.get("n_iter", 1))
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            async with self._slots:
+                duration = self.latency * (1 + self.batch_cost * (batch_size - 1))
+                duration *= max(0.0, 1 + random.uniform(-self.jitter, self.jitter))
+                await asyncio.sleep(duration)
+                if random.random() < self.error_rate:
+                    self.errors += 1
+                    return web.Response(status=self.error_status, text="stub error")
+                seed = int(params.get("seed", 0))
+                images = [self._images[(seed + i) % len(self._images)] for i in range(batch_size)]
+                return web.json_response({"images": images, "parameters": {}, "info": "{}"})
+        finally:
+            self.in_flight -= 1
+
+
+class StubTelegramServer(_StubServer):
+    """Заглушка Bot API: отвечает на методы, которые вызывает бот, и отдаёт файлы фото.
+
+    Все вызовы записываются в events; wait_for_delivery() ждёт, пока в чат
+    уйдёт видео (или сообщение об ошибке). Отказ всплывающим окном на нажатие
+    кнопки (квота, перегрузка) тоже считается ответом — если чат нажатия
+    указан в callback_chats.
+    """
+
+    def __init__(self, photo_size: int = 1280, **kwargs):
+        super().__init__(**kwargs)
+        self.photo = make_jpeg(photo_size, photo_size * 3 // 4)
+        self.events = []
+        self.calls = defaultdict(int)
+        self.uploaded_bytes = 0
+        self._message_id = 1000
+        self._deliveries = defaultdict(asyncio.Queue)
+        self.callback_chats = {}  # id нажатия кнопки -> чат
+        self.app.router.add_post("/bot{token}/{method}", self.method)
+        self.app.router.add_get("/file/bot{token}/{path:.*}", self.file)
+
+    async def file(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.photo, content_type="image/jpeg")
+
+    def _message(self, chat_id: int, **extra) -> dict:
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time()),
+                "chat": {"id": chat_id, "type": "private"}, **extra}
+
+    async def method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        fields = {}
+        for key, value in data.items():
+            if isinstance(value, web.FileField):
+                self.uploaded_bytes += len(value.file.read())
+                fields[key] = "<file>"
+            else:
+                fields[key] = value
+        self.calls[method] += 1
+
+        chat_id = int(fields.get("chat_id", 0) or 0)
+        if method == "answerCallbackQuery":
+            chat_id = self.callback_chats.get(fields.get("callback_query_id"), 0)
+        self.events.append((time(), method, chat_id, fields.get("text")))
+        result = self._result(method, chat_id, fields)
+
+        if method.startswith("send") and method != "sendChatAction":
+            text = fields.get("text") or ""
+            if method != "sendMessage" or text.startswith(("❌", "⚠️")):
+                self._deliveries[chat_id].put_nowait((method, text))
+        elif method == "answerCallbackQuery" and fields.get("show_alert") == "true" and chat_id:
+            self._deliveries[chat_id].put_nowait((method, fields.get("text") or ""))
+
+        return web.json_response({"ok": True, "result": result})
+
+    def _result(self, method: str, chat_id: int, fields: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method == "getFile":
+            file_id = fields.get("file_id")
+            return {"file_id": file_id, "file_unique_id": f"u_{file_id}", "file_size": len(self.photo),
+                    "file_path": f"photos/{file_id}.jpg"}
+        if method in ("answerCallbackQuery", "deleteWebhook", "setWebhook", "deleteMessage"):
+            return True
+        if method == "sendVideo":
+            file_id = f"video_{self._message_id}"
+            video = {"file_id": file_id, "file_unique_id": f"u_{file_id}",
+                     "width": 256, "height": 256, "duration": 1}
+            return self._message(chat_id, video=video)
+        if method in ("sendAnimation", "sendDocument"):
+            file_id = f"file_{self._message_id}"
+            media = {"file_id": file_id, "file_unique_id": f"u_{file_id}"}
+            if method == "sendAnimation":
+                return self._message(chat_id, animation=dict(media, width=256, height=256, duration=1))
+            return self._message(chat_id, document=media)
+        if method == "sendMediaGroup":
+            media = json.loads(fields.get("media", "[]"))
+            return [self._message(chat_id, video={"file_id": f"video_{self._message_id}_{i}",
+                                                  "file_unique_id": f"u_video_{self._message_id}_{i}",
+                                                  "width": 256, "height": 256, "duration": 1})
+                    for i, _ in enumerate(media)]
+        return self._message(chat_id, text=fields.get("text"))
+
+    async def wait_for_delivery(self, chat_id: int, timeout: float):
+        """Ждём видео (❌-сообщение или отказ на кнопку) в чат; возвращает (метод, текст)"""
+        return await asyncio.wait_for(self._deliveries[chat_id].get(), timeout)
+
+
+class StubRedisServer:
+    """Заглушка Redis: GET, SET (EX/PX/NX/XX), DEL, EXPIRE, TTL, PING — столько, сколько нужно state_store"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.commands = defaultdict(int)
+        self.connections = 0
+        self._data = {}  # key -> (value, время истечения или None)
+        self._server = None
+        self._writers = set()
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            self.drop_connections()
+            await self._server.wait_closed()
+
+    def drop_connections(self):
+        """Закрыть соединения клиентов, как при перезапуске Redis"""
+        for writer in list(self._writers):
+            writer.close()
+
+    def _get(self, key: bytes):
+        item = self._data.get(key)
+        if item and item[1] is not None and item[1] <= time():
+            del self._data[key]
+            return None
+        return item
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> list:
+        line = await reader.readuntil(b"\r\n")
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readuntil(b"\r\n"))[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _execute(self, args: list) -> bytes:
+        name = args[0].decode().upper()
+        self.commands[name] += 1
+        if name in ("PING", "AUTH", "SELECT"):
+            return b"+PONG\r\n" if name == "PING" else b"+OK\r\n"
+        if name == "GET":
+            item = self._get(args[1])
+            return b"$-1\r\n" if item is None else b"$%d\r\n%s\r\n" % (len(item[0]), item[0])
+        if name == "SET":
+            key, value, expires_at, options = args[1], args[2], None, [arg.upper() for arg in args[3:]]
+            if b"NX" in options and self._get(key) is not None:
+                return b"$-1\r\n"
+            if b"XX" in options and self._get(key) is None:
+                return b"$-1\r\n"
+            if b"EX" in options:
+                expires_at = time() + int(options[options.index(b"EX") + 1])
+            if b"PX" in options:
+                expires_at = time() + int(options[options.index(b"PX") + 1]) / 1000
+            self._data[key] = (value, expires_at)
+            return b"+OK\r\n"
+        if name == "DEL":
+            removed = sum(1 for key in args[1:] if self._get(key) is not None and self._data.pop(key))
+            return b":%d\r\n" % removed
+        if name == "EXPIRE":
+            item = self._get(args[1])
+            if item is None:
+                return b":0\r\n"
+            self._data[args[1]] = (item[0], time() + int(args[2]))
+            return b":1\r\n"
+        if name == "TTL":
+            item = self._get(args[1])
+            if item is None:
+                return b":-2\r\n"
+            return b":%d\r\n" % (-1 if item[1] is None else int(item[1] - time()))
+        return b"-ERR unknown command '%s'\r\n" % args[0]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                args = await self._read_command(reader)
+                writer.write(self._execute(args))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # Клиент отключился или заглушку останавливают
+        finally:
+            self._writers.discard(writer)
+            writer.close()
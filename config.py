@@ -1,7 +1,7 @@
 # config.py
 BOT_TOKEN = "YOUR_TOKEN"
 
-SD_API_URL = "address"  
+SD_API_URL = "address"  # Один адрес, несколько через запятую или список адресов
 STYLES = {
     "anime": "anime style, vibrant colors, sharp lines, 4k",
     "cyberpunk": "cyberpunk style, neon lights, futuristic city, low details",
@@ -12,3 +12,136 @@ STYLES = {
 FILE_LIFETIME_DAYS = 7  
 CLEANUP_HOUR = 3        
 
+# Параллельная генерация кадров
+SD_MAX_CONCURRENCY = 4  # Всего одновременных запросов к SD на весь бот
+SD_JOB_CONCURRENCY = 2  # Одновременных запросов в рамках одной задачи
+
+
+# Пакетная генерация: один запрос img2img отдаёт сразу несколько кадров
+SD_BATCH_MODE = True
+SD_BATCH_SIZE = 4  # Кадров в одном запросе (batch_size)
+
+# Очередь задач и пул воркеров
+QUEUE_WORKERS = 2             # Сколько видео генерируется одновременно
+QUEUE_POLL_INTERVAL = 5       # Как часто воркер проверяет очередь (сек)
+QUEUE_HEARTBEAT_INTERVAL = 15  # Как часто воркер отмечается в задаче (сек)
+QUEUE_STALE_TIMEOUT = 120     # Через сколько секунд без heartbeat задача считается зависшей
+QUEUE_MAX_ATTEMPTS = 3        # Попыток на одну задачу
+
+# Пул серверов SD: балансировка и проверка здоровья
+SD_HEALTH_PATH = "/internal/ping"  # Запрос для проверки, что сервер жив
+SD_HEALTH_CHECK_INTERVAL = 30      # Как часто проверять серверы (сек)
+SD_HEALTH_TIMEOUT = 5              # Таймаут проверки (сек)
+SD_EJECT_AFTER_FAILURES = 3        # Ошибок подряд до исключения сервера из пула
+SD_LATENCY_SMOOTHING = 0.3         # Вес нового замера в скользящем времени ответа
+
+# Повторы и хеджирование запросов к SD
+SD_RETRY_ATTEMPTS = 3          # Попыток на один запрос (сетевые ошибки, таймауты, 5xx)
+SD_RETRY_BASE_DELAY = 1        # Пауза перед повтором: случайная от 0 до BASE * 2^n сек...
+SD_RETRY_MAX_DELAY = 15        # ...но не больше MAX
+SD_REQUEST_TIMEOUT = 180       # Таймаут одной попытки (сек)
+SD_GENERATION_DEADLINE = 600   # Все запросы задачи вместе с повторами (сек)
+SD_HEDGE_ENABLED = True        # Дублировать медленный запрос на другой сервер SD (нужно 2+ сервера)
+SD_HEDGE_PERCENTILE = 95       # Дублировать, если ответа нет дольше этого перцентиля
+SD_HEDGE_MIN_SAMPLES = 20      # Замеров до включения хеджирования
+SD_HEDGE_MIN_DELAY = 2         # Не дублировать раньше (сек)
+SD_HEDGE_MAX_IN_FLIGHT = 2     # Одновременных дублей на весь бот
+
+# Файлы и кодирование видео
+TEMP_DIR = "temp"          # Временные папки задач
+OUTPUT_DIR = "output"      # Готовые видео
+CHECKPOINT_DIR = "checkpoints"  # Готовые кадры задач в работе (продолжение после перезапуска)
+FFMPEG_BINARY = "ffmpeg"   # Путь к ffmpeg
+
+# Кэш готовых видео (фото + стиль + параметры → file_id в Telegram)
+CACHE_ENABLED = True
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # Лимит локальных mp4 в кэше; срок жизни — FILE_LIFETIME_DAYS
+
+# Общие HTTP-пулы соединений (Telegram и каждый сервер SD)
+HTTP_TELEGRAM_POOL_SIZE = 20  # Соединений к api.telegram.org
+HTTP_SD_POOL_SIZE = 8         # Соединений к одному серверу SD
+HTTP_KEEPALIVE_TIMEOUT = 60   # Сколько держать простаивающее соединение (сек)
+HTTP_DNS_CACHE_TTL = 300      # Кэш DNS (сек)
+
+# Сообщения с прогрессом (лимиты Telegram на правки)
+PROGRESS_GLOBAL_EDITS_PER_SEC = 20  # Правок в секунду на весь бот
+PROGRESS_CHAT_INTERVAL = 3          # Не чаще одной правки в чат за столько секунд
+PROGRESS_HISTORY_SMOOTHING = 0.2    # Вес последней задачи в средней длительности этапов
+
+# Метрики в формате Prometheus (http://METRICS_HOST:METRICS_PORT/metrics)
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9101
+
+# Режим получения обновлений: "polling" или "webhook"
+RUN_MODE = "polling"
+WEBHOOK_URL = ""                      # Публичный адрес бота, например https://bot.example.com
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = ""                   # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; пусто — выводится из BOT_TOKEN
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_QUEUE_SIZE = 1000             # Очередь принятых обновлений; при переполнении отвечаем 503 и Telegram повторит
+WEBHOOK_WORKERS = 16                  # Сколько обновлений обрабатывается одновременно
+WEBHOOK_DRAIN_TIMEOUT = 30            # Сколько ждать обработки очереди при выключении (сек)
+WEBHOOK_MAX_CONNECTIONS = 40          # max_connections для setWebhook
+
+# Состояние пользователей (фото, замок выбора стиля): "memory" — в процессе, "redis" — общее для нескольких экземпляров
+STATE_BACKEND = "memory"
+STATE_REDIS_URL = "redis://127.0.0.1:6379/0"
+STATE_REDIS_POOL_SIZE = 4
+STATE_KEY_PREFIX = "tgbot:"
+STATE_UPLOAD_TTL = 6 * 3600   # Фото без выбранного стиля забывается через столько секунд
+STATE_LOCK_TTL = 60           # Замок от двойного нажатия на кнопку стиля
+
+# Ежедневная очистка в CLEANUP_HOUR: записи и файлы старше FILE_LIFETIME_DAYS
+RETENTION_CHUNK_SIZE = 500        # Строк за одно удаление (короткие транзакции без долгих блокировок)
+RETENTION_CHUNK_PAUSE = 0.1       # Пауза между порциями (сек)
+RETENTION_FILE_GRACE = 3600       # Файлы моложе этого (сек) не трогаем: задача может ещё записывать результат
+RETENTION_TEMP_MAX_AGE = 6 * 3600 # Папки в TEMP_DIR без изменений дольше этого (сек) считаются брошенными
+
+# Плавное видео: между соседними кадрами SD на CPU дорисовываются промежуточные
+VIDEO_FPS = 24              # Частота кадров готового видео
+INTERPOLATION_FRAMES = 8    # Промежуточных кадров между двумя кадрами SD (0 — без интерполяции, как раньше)
+# Насколько кадров генерация может опережать энкодер (ограничивает память задачи).
+# Не меньше SD_JOB_CONCURRENCY пакетов — иначе окно, а не лимит задачи, решает, сколько запросов идёт сразу
+FRAME_PIPELINE_WINDOW = SD_JOB_CONCURRENCY * (SD_BATCH_SIZE if SD_BATCH_MODE else 1)
+
+# Кодирование результата под Telegram: чем меньше файл, тем быстрее загрузка и доставка
+# Ключи профиля (не заданные берутся из ai_processing.ENCODING_DEFAULTS):
+#   format — "mp4" или "webp" (анимированный WebP); send_as — "video", "animation" (GIF как mp4) или "document";
+#   crf, preset, pix_fmt, tune — параметры libx264; faststart — moov в начале файла (воспроизведение до полной загрузки);
+#   max_bytes — целевой размер: битрейт ограничивается под длительность клипа, а превысивший файл пережимается;
+#   quality — качество WebP (0–100)
+VIDEO_ENCODING_PROFILES = {
+    "telegram": {"crf": 26, "preset": "fast"},
+    "small": {"crf": 30, "preset": "fast", "max_bytes": 512 * 1024},
+    "animation": {"send_as": "animation", "crf": 28, "tune": "animation"},
+    "webp": {"format": "webp", "send_as": "document", "quality": 75},
+}
+VIDEO_ENCODING_PROFILE = "telegram"  # Профиль по умолчанию (профиль качества может задать свой ключом "encoding")
+VIDEO_SHORT_CLIP_PROFILE = None      # Профиль для коротких клипов, например "animation"; None — как у остальных
+VIDEO_SHORT_CLIP_SECONDS = 3         # Клип не длиннее этого (сек) считается коротким
+
+# Справедливая очередь и квоты пользователей (users.max_concurrent_jobs / users.daily_job_limit переопределяют для конкретного пользователя)
+QUOTA_CONCURRENT_JOBS = 1         # Видео одного пользователя, генерируемых одновременно
+QUOTA_QUEUED_JOBS = 3             # Незавершённых задач (в очереди и в работе) на пользователя
+QUOTA_DAILY_JOBS = 20             # Задач на пользователя за сутки
+QUEUE_POSITION_INTERVAL = 15      # Как часто обновлять место в очереди у ожидающих (сек)
+QUEUE_ESTIMATED_JOB_SECONDS = 90  # Начальная оценка длительности задачи для расчёта ожидания
+QUEUE_FAIRNESS_WINDOW = 3600      # За какой период (сек) учитывать, кого из пользователей уже обслужили
+FANOUT_MAX_STYLES = 4             # «Все стили сразу»: стилей в одной задаче (1 — кнопки нет; альбом Telegram — до 10)
+
+# Профили качества, от лучшего к худшему; пустой словарь — значения по умолчанию из ai_processing.py
+QUALITY_PROFILES = {
+    "full": {"frames": 8, "steps": 15, "width": 384, "height": 384},
+    "standard": {},
+    "degraded": {"frames": 6, "steps": 8, "encoding": "small"},
+}
+QUALITY_DEFAULT_PROFILE = "standard"
+QUALITY_ADAPTIVE = True          # Выбирать профиль по нагрузке; False — всегда QUALITY_DEFAULT_PROFILE
+QUALITY_LATENCY_SLO = 300        # Целевое время от выбора стиля до готового видео (сек)
+QUALITY_REJECT_FACTOR = 2        # Если даже худший профиль не укладывается в SLO × столько — отказ
+
+# Кэш справочников (стили, статусы) и пользователей в памяти процесса
+REFERENCE_CACHE_TTL = 300     # Перечитывать справочники из БД не чаще (сек)
+USER_ID_CACHE_SIZE = 100000   # Пользователей в кэше telegram_id → users.id
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, insert, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from models import ProcessingStyle, TaskStatus, User
+from session import engine
+from config import REFERENCE_CACHE_TTL, USER_ID_CACHE_SIZE
+
+
+class StyleInfo(NamedTuple):
+    """Стиль из справочника: простые значения, не привязанные к сессии"""
+    id: int
+    style_name: str
+    description: Optional[str]
+
+
+class ReferenceCache:
+    """Справочники (стили и статусы) в памяти процесса.
+
+    Загружаются при запуске (on_startup) и перечитываются из БД не чаще раза в
+    REFERENCE_CACHE_TTL секунд — так подхватываются правки, сделанные прямо в БД.
+    После изменения справочника из кода нужно вызвать invalidate().
+    Стили хранятся как StyleInfo, а не объекты ORM: откат или закрытие сессии,
+    в которой их загрузили, на них не влияет.
+    """
+
+    def __init__(self):
+        self._styles = {}  # id -> StyleInfo
+        self._statuses = {}  # status_name -> id
+        self._loaded_at = None
+
+    async def load(self, session):
+        result = await session.execute(
+            select(ProcessingStyle.id, ProcessingStyle.style_name, ProcessingStyle.description)
+            .order_by(ProcessingStyle.id)
+        )
+        self._styles = {row.id: StyleInfo(*row) for row in result}
+        self._statuses = {
+            status.status_name: status.id for status in (await session.execute(select(TaskStatus))).scalars()
+        }
+        self._loaded_at = monotonic()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    async def _fresh(self, session):
+        if self._loaded_at is None or monotonic() - self._loaded_at > REFERENCE_CACHE_TTL:
+            await self.load(session)
+
+    async def styles(self, session) -> list:
+        await self._fresh(session)
+        return list(self._styles.values())
+
+    async def style(self, session, style_id: int) -> Optional[StyleInfo]:
+        await self._fresh(session)
+        return self._styles.get(style_id)
+
+    async def statuses(self, session) -> dict:
+        await self._fresh(session)
+        return dict(self._statuses)
+
+
+class UserIdCache:
+    """telegram_id → users.id для последних USER_ID_CACHE_SIZE пользователей"""
+
+    def __init__(self, size: int = USER_ID_CACHE_SIZE):
+        self.size = size
+        self._ids = OrderedDict()
+
+    def get(self, telegram_id: int) -> Optional[int]:
+        user_id = self._ids.get(telegram_id)
+        if user_id is not None:
+            self._ids.move_to_end(telegram_id)
+        return user_id
+
+    def put(self, telegram_id: int, user_id: int):
+        self._ids[telegram_id] = user_id
+        self._ids.move_to_end(telegram_id)
+        while len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+
+
+references = ReferenceCache()
+user_ids = UserIdCache()
+
+
+async def find_user_id(session, telegram_id: int) -> Optional[int]:
+    """users.id по telegram_id: из кэша, иначе одним SELECT"""
+    user_id = user_ids.get(telegram_id)
+    if user_id is None:
+        user_id = await session.scalar(select(User.id).where(User.telegram_id == telegram_id))
+        if user_id is not None:
+            user_ids.put(telegram_id, user_id)
+    return user_id
+
+
+async def upsert_user(session, telegram_id: int, username: Optional[str],
+                      first_name: Optional[str], last_name: Optional[str]) -> int:
+    """Регистрация или обновление пользователя одним запросом; возвращает users.id.
+
+    Известный процессу пользователь берётся из кэша без обращения к БД. Новый
+    попадает в кэш только после commit: вызывающий код делает user_ids.put().
+    """
+    user_id = user_ids.get(telegram_id)
+    if user_id is not None:
+        return user_id
+
+    values = {"telegram_id": telegram_id, "username": username, "first_name": first_name, "last_name": last_name}
+    changes = {"username": username, "first_name": first_name, "last_name": last_name}
+    dialect = engine.dialect.name
+    if dialect == "mysql":
+        # LAST_INSERT_ID(id) отдаёт id и новой, и уже существующей строки
+        stmt = mysql.insert(User).values(**values).on_duplicate_key_update(
+            id=func.last_insert_id(User.id), **changes
+        )
+        user_id = (await session.execute(stmt)).lastrowid
+    elif dialect in ("sqlite", "postgresql"):
+        module = sqlite if dialect == "sqlite" else postgresql
+        stmt = module.insert(User).values(**values).on_conflict_do_update(
+            index_elements=[User.telegram_id], set_=changes
+        ).returning(User.id)
+        user_id = (await session.execute(stmt)).scalar_one()
+    else:
+        user_id = await session.scalar(select(User.id).where(User.telegram_id == telegram_id))
+        if user_id is None:
+            user_id = (await session.execute(insert(User).values(**values))).inserted_primary_key[0]
+    return user_id
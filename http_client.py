@@ -0,0 +1,56 @@
+import aiohttp
+
+from config import HTTP_TELEGRAM_POOL_SIZE, HTTP_SD_POOL_SIZE, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL
+
+# Адрес для скачивания файлов из Telegram
+TELEGRAM_FILE_URL = "https://api.telegram.org/file/bot{token}/{path}"
+
+# Общие сессии на всё время работы бота: отдельный пул соединений на каждый хост
+_sessions = {}
+
+
+def _create_session(pool_size: int) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=pool_size,
+        limit_per_host=pool_size,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+def _get_session(key: str, pool_size: int) -> aiohttp.ClientSession:
+    session = _sessions.get(key)
+    if session is None or session.closed:
+        session = _sessions[key] = _create_session(pool_size)
+    return session
+
+
+def telegram_session() -> aiohttp.ClientSession:
+    """Сессия для скачивания файлов из Telegram"""
+    return _get_session("telegram", HTTP_TELEGRAM_POOL_SIZE)
+
+
+def sd_session(backend_url: str) -> aiohttp.ClientSession:
+    """Сессия для конкретного сервера SD"""
+    return _get_session(f"sd:{backend_url}", HTTP_SD_POOL_SIZE)
+
+
+def telegram_file_url(token: str, file_path: str) -> str:
+    return TELEGRAM_FILE_URL.format(token=token, path=file_path)
+
+
+async def startup(sd_urls: list):
+    """Создание сессий при запуске бота (on_startup)"""
+    telegram_session()
+    for url in sd_urls:
+        sd_session(url)
+
+
+async def shutdown():
+    """Закрытие всех сессий при выключении бота (on_shutdown)"""
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    for session in sessions:
+        if not session.closed:
+            await session.close()
@@ -0,0 +1,434 @@
+import asyncio
+import contextvars
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Callable, Awaitable
+
+from sqlalchemy import select, update, func
+
+from models import VideoTask, User
+from session import async_session
+from metrics import registry, STAGE_SECONDS, JOB_SECONDS, QUEUE_DEPTH, JOBS_IN_FLIGHT
+from config import (QUEUE_WORKERS, QUEUE_POLL_INTERVAL, QUEUE_HEARTBEAT_INTERVAL,
+                    QUEUE_STALE_TIMEOUT, QUEUE_MAX_ATTEMPTS, QUEUE_POSITION_INTERVAL,
+                    QUEUE_ESTIMATED_JOB_SECONDS, QUEUE_FAIRNESS_WINDOW, QUOTA_CONCURRENT_JOBS, QUOTA_QUEUED_JOBS, QUOTA_DAILY_JOBS)
+
+# Статусы задач (см. on_startup в main.py)
+STATUS_PENDING = 1
+STATUS_PROCESSING = 2
+STATUS_COMPLETED = 3
+STATUS_FAILED = 4
+STATUS_GROUPED = 5  # Стиль задачи на несколько стилей: выполняется вместе с родительской, в очередь не попадает
+
+# Вес нового замера в средней длительности задачи (для оценки ожидания)
+JOB_SECONDS_SMOOTHING = 0.2
+# Пользователь, которого давно не обслуживали, считается обслуженным «в начале времён»
+NEVER_SERVED = datetime(1970, 1, 1)
+# Событие «задача отпустила воркер» для задачи, выполняемой в текущем контексте
+_worker_slot = contextvars.ContextVar("worker_slot", default=None)
+
+
+def _process_gone(worker_id: str, host: str) -> bool:
+    """True, если worker_id (хост:pid) — процесс этого хоста, которого больше нет.
+
+    Свой pid тоже считается ушедшим: при запуске этот процесс ещё не брал задач,
+    значит, их держал прошлый процесс с тем же pid (обычное дело в контейнере).
+    """
+    worker_host, _, pid = worker_id.rpartition(":")
+    if worker_host != host or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass  # Процесс есть, но чужой — не трогаем
+    return False
+
+
+def _last_served_subquery():
+    """Время последнего запуска задачи каждого пользователя за QUEUE_FAIRNESS_WINDOW"""
+    since = datetime.now() - timedelta(seconds=QUEUE_FAIRNESS_WINDOW)
+    return (
+        select(VideoTask.user_id, func.max(VideoTask.started_at).label("last_started"))
+        .where(VideoTask.started_at >= since)
+        .group_by(VideoTask.user_id)
+        .subquery()
+    )
+
+
+async def check_user_quota(session, user_id: int, videos: int = 1) -> Optional[str]:
+    """Причина отказа, если пользователь (users.id) не может поставить задачу на videos видео, иначе None.
+
+    Число задач в очереди, за сегодня и дневной лимит читаются одним запросом.
+    Задача на несколько стилей занимает одно место в очереди, но в дневной
+    лимит идёт каждое её видео.
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    active, created_today, daily_limit = (await session.execute(select(
+        select(func.count(VideoTask.id))
+        .where(VideoTask.user_id == user_id, VideoTask.status_id.in_([STATUS_PENDING, STATUS_PROCESSING]))
+        .scalar_subquery(),
+        select(func.count(VideoTask.id))
+        .where(VideoTask.user_id == user_id, VideoTask.created_at >= today, VideoTask.status_id != STATUS_FAILED,
+               VideoTask.style_id.is_not(None))
+        .scalar_subquery(),
+        select(func.coalesce(User.daily_job_limit, QUOTA_DAILY_JOBS)).where(User.id == user_id).scalar_subquery()
+    ))).one()
+    if active >= QUOTA_QUEUED_JOBS:
+        return f"У вас уже {active} видео в очереди. Дождитесь, пока они будут готовы."
+
+    daily_limit = daily_limit if daily_limit is not None else QUOTA_DAILY_JOBS
+    if created_today + videos > daily_limit:
+        return f"Дневной лимит ({daily_limit} видео) исчерпан. Попробуйте завтра."
+    return None
+
+
+class JobQueue:
+    """Очередь задач на базе таблицы video_tasks с пулом асинхронных воркеров.
+
+    Задача захватывается через SELECT ... FOR UPDATE SKIP LOCKED, поэтому
+    несколько воркеров (и несколько процессов бота) не возьмут одну задачу дважды.
+    Очередь справедливая (по кругу между пользователями): первым идёт пользователь,
+    у которого сейчас меньше всего видео в работе, при равенстве — тот, чья задача
+    запускалась давнее всех (или ещё ни разу за QUEUE_FAIRNESS_WINDOW), и у него
+    берётся самая старая задача. У каждого одновременно выполняется не больше
+    max_concurrent_jobs (QUOTA_CONCURRENT_JOBS) задач.
+    Пока задача выполняется, воркер обновляет heartbeat_at; задачи с устаревшим
+    heartbeat (бот упал или был перезапущен) возвращаются в очередь, пока
+    не исчерпан лимит попыток QUEUE_MAX_ATTEMPTS. Задачи упавшего процесса
+    этого же хоста возвращаются сразу при запуске и без траты попытки.
+    Обработчик, которому воркер больше не нужен (задача только ждёт чужой
+    результат), вызывает detach(): задача дорабатывает в фоне, а воркер
+    берёт следующую.
+    """
+
+    def __init__(self, handler: Callable[[int], Awaitable[None]],
+                 on_failure: Optional[Callable[[int, str], Awaitable[None]]] = None,
+                 on_positions: Optional[Callable[[dict], Awaitable[None]]] = None,
+                 workers: int = QUEUE_WORKERS):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.on_positions = on_positions
+        self.workers = workers
+        self.average_job_seconds = float(QUEUE_ESTIMATED_JOB_SECONDS)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._detached = set()
+
+    def notify(self):
+        """Разбудить воркеры после добавления новой задачи"""
+        self._wakeup.set()
+
+    @staticmethod
+    def detach():
+        """Отпустить воркер текущей задачи (вызывается из обработчика)"""
+        slot = _worker_slot.get()
+        if slot is not None:
+            slot.set()
+
+    async def pending_count(self, session=None) -> int:
+        """Задач в pending; session — сессия вызывающего (не занимать второе соединение из пула)"""
+        if session is None:
+            async with async_session() as session:
+                return await self.pending_count(session)
+        depth = await session.scalar(
+            select(func.count(VideoTask.id)).where(VideoTask.status_id == STATUS_PENDING)
+        )
+        return depth or 0
+
+    async def collect_metrics(self):
+        QUEUE_DEPTH.set(await self.pending_count())
+
+    async def start(self):
+        registry.add_collector(self.collect_metrics)
+        await self.requeue_orphaned()
+        await self.requeue_stale()
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker_loop(i)))
+        self._tasks.append(asyncio.create_task(self._reaper_loop()))
+        if self.on_positions:
+            self._tasks.append(asyncio.create_task(self._positions_loop()))
+
+    async def stop(self):
+        tasks = self._tasks + list(self._detached)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def claim(self) -> Optional[int]:
+        """Захват следующей задачи по справедливой очереди"""
+        with STAGE_SECONDS.time(stage="db_claim"):
+            return await self._claim()
+
+    async def _claim(self) -> Optional[int]:
+        while True:
+            async with async_session() as session:
+                async with session.begin():
+                    running = (
+                        select(VideoTask.user_id, func.count(VideoTask.id).label("running"))
+                        .where(VideoTask.status_id == STATUS_PROCESSING)
+                        .group_by(VideoTask.user_id)
+                        .subquery()
+                    )
+                    served = _last_served_subquery()
+                    running_count = func.coalesce(running.c.running, 0)
+                    user_limit = func.coalesce(User.max_concurrent_jobs, QUOTA_CONCURRENT_JOBS)
+                    result = await session.execute(
+                        select(VideoTask.id, VideoTask.user_id, user_limit)
+                        .join(User, User.id == VideoTask.user_id)
+                        .outerjoin(running, running.c.user_id == VideoTask.user_id)
+                        .outerjoin(served, served.c.user_id == VideoTask.user_id)
+                        .where(VideoTask.status_id == STATUS_PENDING,
+                               running_count < user_limit)
+                        .order_by(running_count, func.coalesce(served.c.last_started, NEVER_SERVED),
+                                  VideoTask.created_at, VideoTask.id)
+                        .limit(1)
+                        .with_for_update(skip_locked=True, of=VideoTask)
+                    )
+                    row = result.first()
+                    if row is None:
+                        return None
+                    task_id, user_id, limit = row
+
+                    # Число задач в работе выше — снимок: задачу этого же пользователя мог
+                    # только что захватить другой воркер, ещё не сделав commit. Строка
+                    # пользователя блокируется (захваты одного пользователя идут по одному),
+                    # и задачи в работе пересчитываются блокирующим чтением — оно видит
+                    # последние зафиксированные данные. Лимит уже занят — пробуем заново
+                    await session.execute(select(User.id).where(User.id == user_id).with_for_update())
+                    running_now = (await session.execute(
+                        select(VideoTask.id)
+                        .where(VideoTask.user_id == user_id, VideoTask.status_id == STATUS_PROCESSING)
+                        .with_for_update()
+                    )).all()
+                    if len(running_now) >= limit:
+                        continue
+
+                    # Условие по статусу — для БД без SKIP LOCKED (SQLite), где два
+                    # воркера могут выбрать одну строку: проигравший берёт следующую
+                    claimed = await session.execute(
+                        update(VideoTask)
+                        .where(VideoTask.id == task_id, VideoTask.status_id == STATUS_PENDING)
+                        .values(status_id=STATUS_PROCESSING, attempts=VideoTask.attempts + 1,
+                                worker_id=self.worker_id, heartbeat_at=datetime.now(), started_at=datetime.now())
+                    )
+                    if claimed.rowcount == 1:
+                        return task_id
+
+    async def release(self, task_id: int):
+        """Вернуть задачу в очередь без траты попытки (остановка бота)"""
+        async with async_session() as session:
+            await session.execute(
+                update(VideoTask)
+                .where(VideoTask.id == task_id, VideoTask.worker_id == self.worker_id,
+                       VideoTask.status_id == STATUS_PROCESSING)
+                .values(status_id=STATUS_PENDING, attempts=VideoTask.attempts - 1, worker_id=None)
+            )
+            await session.commit()
+
+    async def retry_or_fail(self, task_id: int, error: str):
+        """Повторить задачу или пометить её проваленной, если попытки закончились"""
+        async with async_session() as session:
+            task = await session.get(VideoTask, task_id)
+            if not task or task.status_id != STATUS_PROCESSING:
+                return
+
+            if (task.attempts or 0) < QUEUE_MAX_ATTEMPTS:
+                task.status_id = STATUS_PENDING
+                task.worker_id = None
+                await session.commit()
+                self.notify()
+                print(f"🔁 Задача {task_id} будет повторена (попытка {task.attempts}): {error}")
+                return
+
+            task.status_id = STATUS_FAILED
+            task.completed_at = datetime.now()
+            await session.commit()
+
+        print(f"❌ Задача {task_id} провалена после {QUEUE_MAX_ATTEMPTS} попыток: {error}")
+        if self.on_failure:
+            await self.on_failure(task_id, error)
+
+    async def requeue_stale(self):
+        """Вернуть в очередь задачи, воркер которых перестал отправлять heartbeat"""
+        cutoff = datetime.now() - timedelta(seconds=QUEUE_STALE_TIMEOUT)
+        async with async_session() as session:
+            result = await session.execute(
+                select(VideoTask.id).where(
+                    VideoTask.status_id == STATUS_PROCESSING,
+                    (VideoTask.heartbeat_at == None) | (VideoTask.heartbeat_at < cutoff)  # noqa: E711
+                )
+            )
+            stale_ids = result.scalars().all()
+
+        for task_id in stale_ids:
+            await self.retry_or_fail(task_id, "воркер перестал отвечать")
+
+    async def requeue_orphaned(self):
+        """При запуске: задачи, которые держал завершившийся процесс этого хоста, — сразу в очередь.
+
+        Не ждём QUEUE_STALE_TIMEOUT без heartbeat и не тратим попытку (как в release()):
+        задача не провалилась, бот перезапустили или он упал. Генерация продолжится
+        с контрольной точки. Задачи других хостов и живых процессов остаются reaper'у.
+        """
+        host = socket.gethostname()
+        async with async_session() as session:
+            held = (await session.execute(
+                select(VideoTask.id, VideoTask.worker_id)
+                .where(VideoTask.status_id == STATUS_PROCESSING, VideoTask.worker_id.like(f"{host}:%"))
+            )).all()
+            orphaned = [task_id for task_id, worker_id in held if _process_gone(worker_id, host)]
+            if not orphaned:
+                return
+            await session.execute(
+                update(VideoTask)
+                .where(VideoTask.id.in_(orphaned), VideoTask.status_id == STATUS_PROCESSING)
+                .values(status_id=STATUS_PENDING, attempts=VideoTask.attempts - 1, worker_id=None)
+            )
+            await session.commit()
+        print(f"♻️ Возвращены в очередь задачи прошлого запуска: {', '.join(map(str, orphaned))}")
+
+    async def queue_positions(self) -> dict:
+        """Примерное место в очереди и ожидаемое время до начала (сек) для каждой задачи в pending.
+
+        Следует порядку claim() на текущий момент: сначала пользователи, не
+        достигшие max_concurrent_jobs, среди них — с меньшим числом задач в работе,
+        затем тот, кого дольше всех не обслуживали; у него — самая старая задача.
+        Когда завершатся задачи в работе, заранее не известно, поэтому места
+        пользователей на своём лимите — оценка, а не обещание.
+        """
+        served = _last_served_subquery()
+        async with async_session() as session:
+            pending = (await session.execute(
+                select(VideoTask.id, VideoTask.user_id,
+                       func.coalesce(User.max_concurrent_jobs, QUOTA_CONCURRENT_JOBS))
+                .join(User, User.id == VideoTask.user_id)
+                .where(VideoTask.status_id == STATUS_PENDING)
+                .order_by(VideoTask.created_at, VideoTask.id)
+            )).all()
+            running = dict((await session.execute(
+                select(VideoTask.user_id, func.count(VideoTask.id))
+                .where(VideoTask.status_id == STATUS_PROCESSING)
+                .group_by(VideoTask.user_id)
+            )).all())
+            last_served = dict((await session.execute(select(served.c.user_id, served.c.last_started))).all())
+
+        queues, limits = {}, {}
+        for task_id, user_id, limit in pending:
+            queues.setdefault(user_id, []).append(task_id)
+            limits[user_id] = limit
+        # Порядок обслуживания: (на лимите, задач в работе, последний запуск, номер в общей очереди)
+        running = {user_id: running.get(user_id, 0) for user_id in queues}
+        turns = {user_id: (last_served.get(user_id) or NEVER_SERVED, 0) for user_id in queues}
+        order = {task_id: index for index, (task_id, _, _) in enumerate(pending)}
+
+        positions = {}
+        while queues:
+            user_id = min(queues, key=lambda user: (running[user] >= limits[user], running[user], turns[user],
+                                                    order[queues[user][0]]))
+            task_id = queues[user_id].pop(0)
+            if not queues[user_id]:
+                del queues[user_id]
+            position = len(positions) + 1
+            # Обслуженный пользователь уходит в конец круга
+            running[user_id] += 1
+            turns[user_id] = (datetime.max, position)
+            # Задачи стартуют волнами по числу воркеров
+            positions[task_id] = (position, int(((position - 1) // self.workers + 1) * self.average_job_seconds))
+        return positions
+
+    async def _positions_loop(self):
+        while True:
+            await asyncio.sleep(QUEUE_POSITION_INTERVAL)
+            try:
+                positions = await self.queue_positions()
+                if positions:
+                    await self.on_positions(positions)
+            except Exception as e:
+                print(f"Ошибка расчёта мест в очереди: {e}")
+
+    async def _heartbeat_loop(self, task_id: int):
+        while True:
+            await asyncio.sleep(QUEUE_HEARTBEAT_INTERVAL)
+            try:
+                async with async_session() as session:
+                    await session.execute(
+                        update(VideoTask)
+                        .where(VideoTask.id == task_id, VideoTask.worker_id == self.worker_id)
+                        .values(heartbeat_at=datetime.now())
+                    )
+                    await session.commit()
+            except Exception as e:
+                print(f"Ошибка heartbeat задачи {task_id}: {e}")
+
+    async def _run(self, task_id: int, slot: asyncio.Event):
+        _worker_slot.set(slot)
+        heartbeat = asyncio.create_task(self._heartbeat_loop(task_id))
+        started = time.perf_counter()
+        outcome = "ok"
+        JOBS_IN_FLIGHT.inc()
+        try:
+            await self.handler(task_id)
+            duration = time.perf_counter() - started
+            self.average_job_seconds += JOB_SECONDS_SMOOTHING * (duration - self.average_job_seconds)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            await asyncio.shield(self.release(task_id))
+            raise
+        except Exception as e:
+            outcome = "error"
+            await self.retry_or_fail(task_id, str(e))
+        finally:
+            heartbeat.cancel()
+            JOBS_IN_FLIGHT.dec()
+            JOB_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+    async def _worker_loop(self, number: int):
+        while True:
+            self._wakeup.clear()
+            try:
+                task_id = await self.claim()
+            except Exception as e:
+                print(f"Ошибка воркера {number} при захвате задачи: {e}")
+                task_id = None
+
+            if task_id is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run_in_slot(task_id)
+
+    async def _run_in_slot(self, task_id: int):
+        """Выполнить задачу, пока она не завершится или не отпустит воркер через detach()"""
+        slot = asyncio.Event()
+        run = asyncio.create_task(self._run(task_id, slot))
+        released = asyncio.create_task(slot.wait())
+        try:
+            await asyncio.wait({run, released}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            run.cancel()
+            await asyncio.gather(run, return_exceptions=True)
+            raise
+        finally:
+            released.cancel()
+        if not run.done():
+            self._detached.add(run)
+            run.add_done_callback(self._detached.discard)
+
+    async def _reaper_loop(self):
+        while True:
+            await asyncio.sleep(QUEUE_STALE_TIMEOUT)
+            try:
+                await self.requeue_stale()
+            except Exception as e:
+                print(f"Ошибка проверки зависших задач: {e}")
@@ -8,18 +8,35 @@ from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import aiohttp
 import os
-from time import time
+import signal
+from typing import Optional
 
-from models import Base, User, Upload, VideoTask, ProcessingStyle, TaskStatus, TaskImage
+from models import Base, User, Upload, VideoTask, ProcessingStyle, TaskStatus, TaskImage, VideoCache
 from session import engine, async_session
 from config import SD_API_URL, STYLES
 
 from sqlalchemy import select, delete, insert, update
 from sqlalchemy.exc import NoResultFound, IntegrityError
-
-from ai_processing import generate_ai_video
-
-from config import BOT_TOKEN
+from sqlalchemy.orm import selectinload
+
+from ai_processing import (generate_ai_video, generate_ai_videos, sd_pool, checkpoint_path, remove_checkpoint,
+                           quality_profile, select_encoding)
+import http_client
+import metrics
+from metrics import STAGE_SECONDS
+from progress import ProgressReporter
+import video_cache
+from job_queue import (JobQueue, check_user_quota, STATUS_PENDING, STATUS_PROCESSING, STATUS_COMPLETED, STATUS_FAILED,
+                       STATUS_GROUPED)
+from webhook import WebhookServer
+from state_store import create_state_store
+from retention import run_retention
+from quality import choose_profile
+from single_flight import SingleFlight
+from db_cache import references, user_ids, find_user_id, upsert_user
+
+from config import (BOT_TOKEN, RUN_MODE, CLEANUP_HOUR, QUOTA_QUEUED_JOBS, QUALITY_PROFILES,
+                    STATE_UPLOAD_TTL, STATE_LOCK_TTL, FANOUT_MAX_STYLES)
 
 from aiogram.types import InputFile
 
@@ -27,10 +44,17 @@ from aiogram.types import InputFile
 dp = Dispatcher()
 bot = Bot(token=BOT_TOKEN)
 scheduler = AsyncIOScheduler()
+progress_reporter = ProgressReporter(bot)
+
+# Временные данные пользователей (фото, замок выбора стиля) — в памяти или в Redis, см. STATE_BACKEND
+state = create_state_store()
+
+# Одинаковые задачи (фото + стиль + профиль), идущие одновременно, делят одну генерацию
+generations = SingleFlight()
+
 
-# Кэш для временных данных
-user_temp_data = {}
-progress_tracker = {}
+def user_key(user_id: int) -> str:
+    return f"user:{user_id}"
 
 
 @dp.message(Command("help"))
@@ -42,7 +66,7 @@ async def help_command(message: types.Message):
         "3. Выберите стиль из предложенных\n"
         "4. Подождите около часа пока идет обработка\n"
         "5. Получите готовое видео!\n\n"
-        "Обратите внимание: одновременно можно обрабатывать только одно фото."
+        f"Обратите внимание: в очереди может быть не больше {QUOTA_QUEUED_JOBS} ваших видео."
     )
     await message.answer(help_text)
 
@@ -78,15 +102,14 @@ async def owner_command(message: types.Message):
 async def get_file_url(file_id: str) -> str:
     """Получение URL файла в Telegram"""
     file = await bot.get_file(file_id)
-    return f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
+    return http_client.telegram_file_url(BOT_TOKEN, file.file_path)
 
 
 async def download_file(url: str, path: str):
     """Скачивание файла по URL"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            with open(path, 'wb') as f:
-                f.write(await resp.read())
+    async with http_client.telegram_session().get(url) as resp:
+        with open(path, 'wb') as f:
+            f.write(await resp.read())
 
 
 @dp.message(CommandStart())
@@ -101,48 +124,44 @@ async def start(message: types.Message):
 async def handle_photo(message: types.Message):
     user_id = message.from_user.id
 
-    # Проверяем, есть ли уже фото у пользователя
-    if user_id in user_temp_data and user_temp_data[user_id].get("uploads"):
-        await message.answer("❌ Вы уже отправили фото. Дождитесь завершения текущей обработки.")
-        return
-
     file_id = message.photo[-1].file_id
+    file_unique_id = message.photo[-1].file_unique_id
 
     async with async_session() as session:
         try:
-            # Регистрация/обновление пользователя
-            user = await session.execute(select(User).where(User.telegram_id == user_id))
-            user = user.scalar()
-
-            if not user:
-                user = User(
-                    telegram_id=user_id,
-                    username=message.from_user.username,
-                    first_name=message.from_user.first_name,
-                    last_name=message.from_user.last_name,
-                )
-                session.add(user)
+            # Регистрация/обновление пользователя (известный — из кэша, новый — одним upsert)
+            db_user_id = await upsert_user(
+                session,
+                user_id,
+                message.from_user.username,
+                message.from_user.first_name,
+                message.from_user.last_name
+            )
+
+            # Проверяем квоты (число задач в очереди и за день) по БД
+            quota_error = await check_user_quota(session, db_user_id)
+            if quota_error:
                 await session.commit()
+                user_ids.put(user_id, db_user_id)
+                await message.answer(f"❌ {quota_error}")
+                return
 
-            # Сохраняем загрузку (только одну)
-            await session.execute(delete(Upload).where(Upload.user_id == user.id))
-            upload = Upload(
-                user_id=user.id,
+            # Сохраняем загрузку: прежнее фото без задачи заменяется новым (всё — одной транзакцией)
+            await session.execute(
+                delete(Upload).where(Upload.user_id == db_user_id, ~Upload.task_images.any())
+            )
+            session.add(Upload(
+                user_id=db_user_id,
                 file_id=file_id,
+                file_unique_id=file_unique_id,
                 is_photo="1"
-            )
-            session.add(upload)
-            await session.commit()
-
-            # Сохраняем во временные данные
-            user_temp_data[user_id] = {"uploads": [file_id]}
+            ))
+            with STAGE_SECONDS.time(stage="db_commit"):
+                await session.commit()
+            user_ids.put(user_id, db_user_id)
 
-            # Инициализируем трекер прогресса
-            progress_tracker[user_id] = {
-                "start_time": None,
-                "progress": 0,
-                "message_id": None
-            }
+            # Сохраняем во временные данные (фото без выбранного стиля истечёт само)
+            await state.set(user_key(user_id), {"uploads": [file_id]}, ttl=STATE_UPLOAD_TTL)
 
             # Клавиатура с действиями
             builder = ReplyKeyboardBuilder()
@@ -161,14 +180,14 @@ async def handle_photo(message: types.Message):
 async def select_style(message: types.Message):
     user_id = message.from_user.id
 
-    if user_id not in user_temp_data or not user_temp_data[user_id].get("uploads"):
+    user_state = await state.get(user_key(user_id))
+    if not user_state or not user_state.get("uploads"):
         await message.answer("Сначала загрузите фото!")
         return
 
     async with async_session() as session:
         try:
-            styles = await session.execute(select(ProcessingStyle))
-            styles = styles.scalars().all()
+            styles = await references.styles(session)
 
             if not styles:
                 await message.answer("⚠️ Нет доступных стилей. Попробуйте позже.")
@@ -180,6 +199,8 @@ async def select_style(message: types.Message):
                     text=style.style_name,
                     callback_data=f"style_{style.id}"
                 )
+            if len(styles) > 1 and FANOUT_MAX_STYLES > 1:
+                builder.button(text="🧩 Все стили сразу", callback_data="styles_all")
             builder.adjust(2)
 
             await message.answer(
@@ -191,212 +212,539 @@ async def select_style(message: types.Message):
             await message.answer(f"Ошибка при загрузке стилей: {str(e)}")
 
 
-@dp.callback_query(F.data.startswith("style_"))
+@dp.callback_query(F.data.startswith("style_") | (F.data == "styles_all"))
 async def process_style_selection(callback: types.CallbackQuery):
-    """Обработчик выбора стиля для создания видео"""
+    """Обработчик выбора стиля (или всех стилей сразу): ставит задачу в очередь и сразу отвечает"""
     user_id = callback.from_user.id
     chat_id = callback.message.chat.id
 
     try:
-        # 1. Извлекаем ID стиля
-        try:
-            style_id = int(callback.data.split("_")[1])
-        except (IndexError, ValueError):
-            await callback.answer("Неверный формат стиля!")
-            return
+        # 1. Извлекаем ID стиля (None — все стили)
+        style_id = None
+        if callback.data != "styles_all":
+            try:
+                style_id = int(callback.data.split("_")[1])
+            except (IndexError, ValueError):
+                await callback.answer("Неверный формат стиля!")
+                return
 
-        # 2. Проверяем наличие загруженного фото
-        if not user_temp_data.get(user_id, {}).get("uploads"):
-            await callback.answer("Сначала загрузите фото!")
+        # 2. Замок от двойного нажатия (в том числе если бот запущен в нескольких экземплярах)
+        lock_key = f"lock:style:{user_id}"
+        if not await state.set_if_absent(lock_key, {"style_id": style_id}, ttl=STATE_LOCK_TTL):
+            await callback.answer("Видео уже в обработке!")
             return
 
-        async with async_session() as session:
-            try:
-                # 3. Получаем данные стиля
-                style = await session.get(ProcessingStyle, style_id)
-                if not style:
-                    await callback.answer("Стиль недоступен!")
-                    return
+        try:
+            await create_task_for_style(callback, user_id, chat_id, style_id)
+        finally:
+            await state.delete(lock_key)
 
-                # 4. Получаем пользователя
-                user = await session.execute(
-                    select(User).where(User.telegram_id == user_id)
-                )
-                user = user.scalar_one_or_none()
+    except Exception as e:
+        error_msg = f"Неожиданная ошибка: {str(e)}"
+        await bot.send_message(chat_id=chat_id, text="⚠️ Ошибка системы")
+        print(error_msg)
+
+
+async def create_task_for_style(callback: types.CallbackQuery, user_id: int, chat_id: int,
+                                style_id: Optional[int]):
+    """Постановка задачи в очередь (или ответ из кэша) под замком пользователя.
+
+    style_id=None — задача сразу на все стили (не больше FANOUT_MAX_STYLES):
+    родительская задача в очереди и по задаче на каждый стиль.
+    """
+    # Проверяем наличие загруженного фото
+    user_state = await state.get(user_key(user_id))
+    if not user_state or not user_state.get("uploads"):
+        await callback.answer("Сначала загрузите фото!")
+        return
+
+    async with async_session() as session:
+        try:
+            # 3. Получаем данные стиля
+            if style_id is None:
+                styles = (await references.styles(session))[:FANOUT_MAX_STYLES]
+            else:
+                styles = [await references.style(session, style_id)]
+            if not styles or not styles[0]:
+                await callback.answer("Стиль недоступен!")
+                return
+            style = styles[0]
 
-                if not user:
-                    await callback.answer("Пользователь не найден!")
+            # 4. Получаем пользователя
+            db_user_id = await find_user_id(session, user_id)
+
+            if db_user_id is None:
+                await callback.answer("Пользователь не найден!")
+                return
+
+            quota_error = await check_user_quota(session, db_user_id, videos=len(styles))
+            if quota_error:
+                await callback.answer(quota_error, show_alert=True)
+                return
+
+            # 5. Ищем загруженное фото
+            upload = await session.execute(
+                select(Upload)
+                .where(Upload.file_id == user_state["uploads"][0], Upload.user_id == db_user_id)
+                .limit(1)
+            )
+            upload = upload.scalar_one_or_none()
+
+            # 6. Профиль качества по текущей нагрузке (или отказ при перегрузке)
+            decision = choose_profile(await job_queue.pending_count(session), job_queue.workers,
+                                      job_queue.average_job_seconds, styles=len(styles))
+
+            # 7. Такое видео уже делали — отдаём из кэша без генерации
+            # (подходит любой профиль не хуже выбранного; при перегрузке — любой).
+            # Для нескольких стилей кэш проверяет воркер — по каждому стилю
+            profiles = list(QUALITY_PROFILES)
+            if decision.profile is not None:
+                profiles = profiles[:profiles.index(decision.profile) + 1]
+            for profile_name in profiles if upload and len(styles) == 1 else []:
+                cache_key = video_cache.make_cache_key(upload.file_unique_id or upload.file_id,
+                                                       style.style_name, profile_name)
+                cached = await video_cache.lookup(cache_key, session)
+                if cached:
+                    await callback.answer(f"Стиль: {style.style_name}")
+                    await send_cached_video(chat_id, cached, style.style_name, profile_name, session)
+                    session.add(VideoTask(
+                        user_id=db_user_id,
+                        status_id=STATUS_COMPLETED,
+                        style_id=style.id,
+                        created_at=datetime.now(),
+                        completed_at=datetime.now(),
+                        result_path=cached.result_path,
+                        chat_id=chat_id,
+                        quality_profile=profile_name
+                    ))
+                    with STAGE_SECONDS.time(stage="db_commit"):
+                        await session.commit()
+                    await state.delete(user_key(user_id))
                     return
 
-                # 5. Создаем задачу обработки
-                task = VideoTask(
-                    user_id=user.id,
-                    status_id=1,  # pending
-                    style_id=style.id,
-                    created_at=datetime.now()
+            if decision.profile is None:
+                minutes = max(1, decision.retry_after // 60)
+                await callback.answer(
+                    f"⚠️ Сейчас слишком много заказов. Попробуйте через {minutes} мин — фото сохранено.",
+                    show_alert=True
                 )
-                session.add(task)
-                await session.flush()
+                return
+
+            # 8. Сообщение для прогресса (его будет обновлять воркер)
+            progress_msg = await bot.send_message(
+                chat_id=chat_id,
+                text="⏳ Задача поставлена в очередь..."
+            )
 
-                # 6. Связываем фото с задачей
-                upload = await session.execute(
-                    select(Upload)
-                    .where(Upload.file_id == user_temp_data[user_id]["uploads"][0])
-                    .limit(1)
+            # 9. Создаем задачу обработки (на несколько стилей — ещё и по задаче на стиль)
+            fanout = len(styles) > 1
+            task = VideoTask(
+                user_id=db_user_id,
+                status_id=STATUS_PENDING,
+                style_id=None if fanout else style.id,
+                created_at=datetime.now(),
+                chat_id=chat_id,
+                progress_message_id=progress_msg.message_id,
+                quality_profile=decision.profile
+            )
+            session.add(task)
+            await session.flush()
+
+            subtasks = [
+                VideoTask(
+                    user_id=db_user_id,
+                    status_id=STATUS_GROUPED,
+                    style_id=fanout_style.id,
+                    parent_id=task.id,
+                    created_at=datetime.now(),
+                    chat_id=chat_id,
+                    quality_profile=decision.profile
                 )
-                upload = upload.scalar_one_or_none()
+                for fanout_style in styles
+            ] if fanout else []
+            if subtasks:
+                session.add_all(subtasks)
+                await session.flush()
 
-                if upload:
+            # 10. Связываем фото с задачей (и с задачами по стилям)
+            if upload:
+                for linked_task in [task] + subtasks:
                     task_image = TaskImage(
-                        task_id=task.id,
+                        task_id=linked_task.id,
                         upload_id=upload.id,
                         order_index=0
                     )
                     session.add(task_image)
 
+            with STAGE_SECONDS.time(stage="db_commit"):
                 await session.commit()
 
-                # 7. Инициализируем прогресс
-                progress_msg = await bot.send_message(
-                    chat_id=chat_id,
-                    text="🔄 Начинаю обработку..."
-                )
-                progress_tracker[user_id] = {
-                    "start_time": time(),
-                    "progress": 0,
-                    "message_id": progress_msg.message_id,
-                    "task_id": task.id,
-                    "chat_id": chat_id
-                }
-
+            # Фото ушло в задачу — можно присылать следующее
+            await state.delete(user_key(user_id))
+            if fanout:
+                await callback.answer(f"Стили: {', '.join(item.style_name for item in styles)}")
+            else:
                 await callback.answer(f"Стиль: {style.style_name}")
 
-                # 8. Обновляем статус задачи
-                task.status_id = 2  # processing
-                await session.commit()
+            # 11. Будим воркеры — генерация идёт вне обработчика
+            job_queue.notify()
 
-                # 9. Генерируем видео
-                try:
-                    video_path = await generate_ai_video(
-                        user_temp_data[user_id]["uploads"],
-                        style.style_name.lower(),
-                        bot,
-                        progress_callback=lambda p: update_progress(user_id, p)
-                    )
+            progress_reporter.track(task.id, chat_id, progress_msg.message_id)
 
-                    # 10. Обновляем задачу
-                    task.status_id = 3  # completed
-                    task.completed_at = datetime.now()
-                    task.result_path = video_path
-                    await session.commit()
-
-                    # 11. Отправляем видео (исправленная часть)
-                    try:
-                        video_input = types.BufferedInputFile.from_file(video_path)
-                        await bot.send_video(
-                            chat_id=chat_id,
-                            video=video_input,
-                            caption=f"🎥 Готово! Стиль: {style.style_name}",
-                            supports_streaming=True
-                        )
-                    except Exception as send_error:
-                        print(f"Ошибка отправки видео: {send_error}")
-                        await bot.send_message(
-                            chat_id=chat_id,
-                            text="❌ Не удалось отправить видео. Попробуйте позже."
-                        )
-
-                except Exception as e:
-                    # 12. Обработка ошибок генерации
-                    task.status_id = 4  # failed
-                    task.completed_at = datetime.now()
-                    await session.commit()
-
-                    error_msg = f"❌ Ошибка: {str(e)}"
-                    await bot.send_message(chat_id=chat_id, text=error_msg)
-                    print(f"Ошибка для user {user_id}: {error_msg}")
-
-            except Exception as e:
-                await session.rollback()
-                error_msg = f"Ошибка БД: {str(e)}"
-                await bot.send_message(chat_id=chat_id, text="⚠️ Ошибка системы")
-                print(error_msg)
+        except Exception as e:
+            await session.rollback()
+            error_msg = f"Ошибка БД: {str(e)}"
+            await bot.send_message(chat_id=chat_id, text="⚠️ Ошибка системы")
+            print(error_msg)
+            return
 
+    # 12. Место в очереди (дальше обновляется раз в QUEUE_POSITION_INTERVAL) — уже без соединения обработчика
+    try:
+        await report_queue_positions(await job_queue.queue_positions())
     except Exception as e:
-        error_msg = f"Неожиданная ошибка: {str(e)}"
-        await bot.send_message(chat_id=chat_id, text="⚠️ Ошибка системы")
-        print(error_msg)
-    finally:
-        # 13. Очистка временных данных
-        user_temp_data.pop(user_id, None)
-        progress_tracker.pop(user_id, None)
+        print(f"Ошибка расчёта мест в очереди: {e}")
 
 
-async def update_progress(user_id: int, progress: int):
-    """Обновление прогресса в реальном времени"""
-    if user_id not in progress_tracker:
-        return
-
-    tracker = progress_tracker[user_id]
-    chat_id = tracker.get("chat_id")
-    if not chat_id:
+async def process_task(task_id: int):
+    """Генерация видео для задачи из очереди (выполняется воркером)"""
+    # 1. Читаем задачу; сессия не держится открытой во время генерации
+    async with async_session() as session:
+        result = await session.execute(
+            select(VideoTask)
+            .where(VideoTask.id == task_id)
+            .options(
+                selectinload(VideoTask.user),
+                selectinload(VideoTask.style),
+                selectinload(VideoTask.images).selectinload(TaskImage.upload),
+                selectinload(VideoTask.subtasks).selectinload(VideoTask.style)
+            )
+        )
+        task = result.scalar_one()
+        user_id = task.user.telegram_id
+        chat_id = task.chat_id or user_id
+        subtasks = list(task.subtasks)
+        style_name = task.style.style_name if task.style else None
+        profile_name = task.quality_profile
+        uploads = [
+            image.upload
+            for image in sorted(task.images, key=lambda image: image.order_index)
+            if image.upload
+        ]
+        file_ids = [upload.file_id for upload in uploads]
+
+    if not file_ids:
+        raise Exception("Фото для задачи не найдено")
+
+    # 2. Инициализируем прогресс
+    progress_reporter.track(task_id, chat_id, task.progress_message_id)
+
+    if subtasks:
+        await process_fanout_task(task_id, chat_id, uploads, subtasks, profile_name)
         return
+    cache_key = video_cache.make_cache_key(uploads[0].file_unique_id or uploads[0].file_id, style_name, profile_name)
+
+    # 3. Генерируем видео (ошибка уходит в очередь: повтор или провал задачи).
+    # Если такое же видео уже генерируется, задача присоединяется к нему.
+    # Готовые кадры сохраняются в контрольную точку задачи: после перезапуска
+    # или повтора генерация продолжится с них
+    async def generate(on_progress):
+        # Пока задача ждала в очереди, такое же видео могли уже сделать
+        cached = await video_cache.lookup(cache_key)
+        if cached and cached.result_path and os.path.exists(cached.result_path):
+            return cached.result_path
+        video_path = await generate_ai_video(
+            file_ids,
+            style_name.lower(),
+            bot,
+            progress_callback=on_progress,
+            profile_name=profile_name,
+            checkpoint_dir=checkpoint_path(task_id)
+        )
+        # Запись в кэш — один раз на генерацию; file_id добавит первая удачная отправка
+        try:
+            await video_cache.store(cache_key, video_path, None)
+        except Exception as e:
+            print(f"Ошибка сохранения в кэш: {e}")
+        return video_path
 
+    # Присоединившаяся задача только ждёт чужую генерацию — место воркера ей не нужно
+    if cache_key in generations:
+        job_queue.detach()
     try:
-        tracker["progress"] = progress
-
-        if tracker.get("message_id") is None:
-            return
+        video_path, _ = await generations.run(
+            cache_key, generate, lambda p, stage: update_progress(task_id, p, stage)
+        )
+    except BaseException:
+        progress_reporter.finish(task_id, success=False)
+        raise
+    progress_reporter.finish(task_id)
 
-        elapsed = int(time() - tracker["start_time"])
-        remaining = int((100 - progress) * elapsed / max(1, progress))
+    # 4. Обновляем задачу
+    with STAGE_SECONDS.time(stage="db_commit"):
+        async with async_session() as session:
+            await session.execute(
+                update(VideoTask)
+                .where(VideoTask.id == task_id)
+                .values(status_id=STATUS_COMPLETED, completed_at=datetime.now(), result_path=video_path)
+            )
+            await session.commit()
+    await asyncio.to_thread(remove_checkpoint, task_id)
 
-        progress_text = (
-            f"🔄 Прогресс: {progress}%\n"
-            f"⏱ Прошло: {elapsed // 60} мин {elapsed % 60} сек\n"
-            f"⏳ Осталось: ~{remaining // 60} мин"
+    # 5. Отправляем видео и запоминаем его file_id для повторных запросов
+    # (если это видео уже загружено в Telegram — например, другой задачей с тем же фото — берём file_id)
+    cached = await video_cache.lookup(cache_key)
+    try:
+        video_input = cached.telegram_file_id if cached and cached.telegram_file_id \
+            else types.FSInputFile(video_path)
+        with STAGE_SECONDS.time(stage="telegram_upload"):
+            sent = await send_result(chat_id, video_input, f"🎥 Готово! Стиль: {style_name}", profile_name)
+    except Exception as send_error:
+        sent = None
+        print(f"Ошибка отправки видео: {send_error}")
+        await bot.send_message(
+            chat_id=chat_id,
+            text="❌ Не удалось отправить видео. Попробуйте позже."
         )
 
-        await bot.edit_message_text(
+    # file_id запоминает любая задача, чья отправка удалась, пока в кэше его нет
+    file_id = sent_file_id(sent)
+    if not file_id or (cached and cached.telegram_file_id):
+        return
+    try:
+        await video_cache.store(cache_key, video_path, file_id)
+    except Exception as e:
+        print(f"Ошибка сохранения в кэш: {e}")
+
+
+async def process_fanout_task(task_id: int, chat_id: int, uploads: list, subtasks: list, profile_name: str):
+    """Задача на несколько стилей: фото готовится один раз, стили генерируются
+    вместе, видео уходят одним альбомом. Стили, которые уже есть в кэше, не генерируются.
+    """
+    input_id = uploads[0].file_unique_id or uploads[0].file_id
+    cache_keys = {
+        subtask.id: video_cache.make_cache_key(input_id, subtask.style.style_name, profile_name)
+        for subtask in subtasks
+    }
+    results = {}  # id задачи стиля -> (путь к видео, file_id в Telegram или None)
+    to_render = []
+    for subtask in subtasks:
+        cached = await video_cache.lookup(cache_keys[subtask.id])
+        if cached:
+            results[subtask.id] = (cached.result_path, cached.telegram_file_id)
+        else:
+            to_render.append(subtask)
+
+    # 3. Генерируем недостающие стили (если не вышел ни один — задача уходит на повтор)
+    errors = {}
+    try:
+        rendered = await generate_ai_videos(
+            [upload.file_id for upload in uploads],
+            [subtask.style.style_name.lower() for subtask in to_render],
+            bot,
+            progress_callback=lambda p, stage: update_progress(task_id, p, stage),
+            profile_name=profile_name,
+            checkpoint_dirs=[checkpoint_path(subtask.id) for subtask in to_render]
+        ) if to_render else []
+        for subtask, result in zip(to_render, rendered):
+            if isinstance(result, BaseException):
+                errors[subtask.id] = result
+                print(f"⚠️ Задача {task_id}: стиль {subtask.style.style_name} не удался: {result}")
+            else:
+                results[subtask.id] = (result, None)
+        if not results:
+            raise Exception(f"❌ Ошибка: {next(iter(errors.values()))}")
+    except BaseException:
+        progress_reporter.finish(task_id, success=False)
+        raise
+    progress_reporter.finish(task_id)
+
+    # 4. Обновляем задачу и задачи по стилям
+    now = datetime.now()
+    with STAGE_SECONDS.time(stage="db_commit"):
+        async with async_session() as session:
+            for subtask in subtasks:
+                if subtask.id in results:
+                    values = {"status_id": STATUS_COMPLETED, "result_path": results[subtask.id][0]}
+                else:
+                    values = {"status_id": STATUS_FAILED}
+                await session.execute(
+                    update(VideoTask).where(VideoTask.id == subtask.id).values(completed_at=now, **values)
+                )
+            await session.execute(
+                update(VideoTask)
+                .where(VideoTask.id == task_id)
+                .values(status_id=STATUS_COMPLETED, completed_at=now)
+            )
+            await session.commit()
+    for subtask in subtasks:
+        await asyncio.to_thread(remove_checkpoint, subtask.id)
+
+    # 5. Отправляем видео одним альбомом (Telegram: 2–10 элементов; анимации альбомом не отправить)
+    delivered = [subtask for subtask in subtasks if subtask.id in results]
+    send_as = select_encoding(quality_profile(profile_name))["send_as"]
+    items = [
+        (results[subtask.id][1] or types.FSInputFile(results[subtask.id][0]),
+         f"🎥 Стиль: {subtask.style.style_name}")
+        for subtask in delivered
+    ]
+    try:
+        with STAGE_SECONDS.time(stage="telegram_upload"):
+            if len(items) == 1 or send_as == "animation":
+                sent = [await send_result(chat_id, item, caption, profile_name) for item, caption in items]
+            elif send_as == "document":
+                sent = await bot.send_media_group(chat_id=chat_id, media=[
+                    types.InputMediaDocument(media=item, caption=caption) for item, caption in items
+                ])
+            else:
+                sent = await bot.send_media_group(chat_id=chat_id, media=[
+                    types.InputMediaVideo(media=item, caption=caption, supports_streaming=True)
+                    for item, caption in items
+                ])
+        if errors:
+            failed = ", ".join(subtask.style.style_name for subtask in subtasks if subtask.id in errors)
+            await bot.send_message(chat_id=chat_id, text=f"⚠️ Не удалось сделать видео в стилях: {failed}")
+    except Exception as send_error:
+        sent = []
+        print(f"Ошибка отправки видео: {send_error}")
+        await bot.send_message(
             chat_id=chat_id,
-            message_id=tracker["message_id"],
-            text=progress_text
+            text="❌ Не удалось отправить видео. Попробуйте позже."
         )
+
+    # Новые видео — в кэш, чтобы по одному стилю их тоже можно было отдать сразу
+    sent_file_ids = {subtask.id: sent_file_id(message) for subtask, message in zip(delivered, sent)}
+    for subtask in delivered:
+        if results[subtask.id][1]:
+            continue
+        try:
+            await video_cache.store(cache_keys[subtask.id], results[subtask.id][0], sent_file_ids.get(subtask.id))
+        except Exception as e:
+            print(f"Ошибка сохранения в кэш: {e}")
+
+
+async def send_result(chat_id: int, video, caption: str, profile_name: Optional[str] = None) -> types.Message:
+    """Отправка результата так, как задаёт профиль кодирования: видео, анимация (GIF как mp4) или файл.
+
+    video — file_id или types.FSInputFile: файл читается с диска частями во время загрузки.
+    """
+    send_as = select_encoding(quality_profile(profile_name))["send_as"]
+    if send_as == "animation":
+        return await bot.send_animation(chat_id=chat_id, animation=video, caption=caption)
+    if send_as == "document":
+        return await bot.send_document(chat_id=chat_id, document=video, caption=caption)
+    return await bot.send_video(chat_id=chat_id, video=video, caption=caption, supports_streaming=True)
+
+
+def sent_file_id(message: Optional[types.Message]) -> Optional[str]:
+    """file_id отправленного результата — для повторной отправки без загрузки"""
+    media = message and (message.video or message.animation or message.document)
+    return media.file_id if media else None
+
+
+async def send_cached_video(chat_id: int, cached: VideoCache, style_name: str, profile_name: Optional[str] = None,
+                            session=None):
+    """Отправка видео из кэша: по file_id без повторной загрузки, иначе с диска.
+
+    session — открытая сессия обработчика, в которой запоминается полученный file_id.
+    """
+    caption = f"🎥 Готово! Стиль: {style_name}"
+    if cached.telegram_file_id:
+        await send_result(chat_id, cached.telegram_file_id, caption, profile_name)
+        return
+
+    sent = await send_result(chat_id, types.FSInputFile(cached.result_path), caption, profile_name)
+    await video_cache.store(cached.cache_key, cached.result_path, sent_file_id(sent), session)
+
+
+async def on_task_failed(task_id: int, error: str):
+    """Уведомление пользователя, когда попытки задачи закончились"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(VideoTask).where(VideoTask.id == task_id).options(selectinload(VideoTask.user))
+        )
+        task = result.scalar_one_or_none()
+        if not task:
+            return
+        user_id = task.user.telegram_id
+        chat_id = task.chat_id or user_id
+
+    progress_reporter.finish(task_id, success=False)
+    await asyncio.to_thread(remove_checkpoint, task_id)
+
+    # Задачи по стилям проваливаются вместе с родительской
+    async with async_session() as session:
+        subtask_ids = (await session.execute(
+            select(VideoTask.id).where(VideoTask.parent_id == task_id, VideoTask.status_id == STATUS_GROUPED)
+        )).scalars().all()
+        if subtask_ids:
+            await session.execute(
+                update(VideoTask)
+                .where(VideoTask.id.in_(subtask_ids))
+                .values(status_id=STATUS_FAILED, completed_at=datetime.now())
+            )
+            await session.commit()
+    for subtask_id in subtask_ids:
+        await asyncio.to_thread(remove_checkpoint, subtask_id)
+
+    error_msg = f"❌ Ошибка: {error}"
+    try:
+        await bot.send_message(chat_id=chat_id, text=error_msg)
     except Exception as e:
-        print(f"Ошибка обновления прогресса: {str(e)}")
+        print(f"Ошибка отправки сообщения: {e}")
+    print(f"Ошибка для user {user_id}: {error_msg}")
+
+
+async def report_queue_positions(positions: dict):
+    """Место в очереди и ожидание для задач, чьи сообщения ведёт этот процесс"""
+    for task_id, (position, wait_seconds) in positions.items():
+        await progress_reporter.report_queued(task_id, position, wait_seconds)
+
+
+job_queue = JobQueue(process_task, on_failure=on_task_failed, on_positions=report_queue_positions)
+
+
+async def update_progress(task_id: int, progress: int, stage: str = "generate"):
+    """Обновление прогресса: правку сообщения отправит ProgressReporter с учётом лимитов"""
+    await progress_reporter.report(task_id, progress, stage)
 
 
 async def cleanup_old_files():
-    """Очистка старых файлов"""
-    async with async_session() as session:
-        cutoff = datetime.now() - timedelta(days=7)
-        await session.execute(delete(Upload).where(Upload.upload_time < cutoff))
-        await session.commit()
+    """Очистка старых файлов (по расписанию в CLEANUP_HOUR)"""
+    try:
+        await run_retention()
+    except Exception as e:
+        print(f"Ошибка очистки: {e}")
 
 
 async def on_startup():
+    await http_client.startup([backend.url for backend in sd_pool.backends])
+    await state.ping()
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
     async with async_session() as session:
-        # Проверяем, есть ли уже статусы в базе
-        existing_statuses = await session.execute(select(TaskStatus))
-        if not existing_statuses.scalars().all():
-            # Добавляем статусы только если их нет
-            statuses = [
-                {"id": 1, "status_name": "pending"},
-                {"id": 2, "status_name": "processing"},
-                {"id": 3, "status_name": "completed"},
-                {"id": 4, "status_name": "failed"}
-            ]
-
-            for status in statuses:
+        # Справочники читаются один раз и дальше берутся из памяти (db_cache.py)
+        await references.load(session)
+
+        # Добавляем статусы, которых ещё нет в базе
+        statuses = [
+            {"id": STATUS_PENDING, "status_name": "pending"},
+            {"id": STATUS_PROCESSING, "status_name": "processing"},
+            {"id": STATUS_COMPLETED, "status_name": "completed"},
+            {"id": STATUS_FAILED, "status_name": "failed"},
+            {"id": STATUS_GROUPED, "status_name": "grouped"}
+        ]
+        existing_statuses = await references.statuses(session)
+        missing_statuses = [status for status in statuses if status["status_name"] not in existing_statuses]
+        if missing_statuses:
+            for status in missing_statuses:
                 session.add(TaskStatus(**status))
             await session.commit()
+            references.invalidate()
 
         # Проверяем и добавляем стили обработки
-        existing_styles = await session.execute(select(ProcessingStyle))
-        if not existing_styles.scalars().all():
+        if not await references.styles(session):
             # Добавляем базовые стили
             styles = [
                 {"style_name": "anime", "description": "Аниме стиль"},
@@ -407,16 +755,62 @@ async def on_startup():
             for style in styles:
                 session.add(ProcessingStyle(**style))
             await session.commit()
+            references.invalidate()
+
+    await video_cache.evict()
+    sd_pool.start()
+    progress_reporter.start()
+
+    # Воркеры подхватят и задачи, оставшиеся с прошлого запуска
+    await job_queue.start()
+
+    scheduler.add_job(
+        cleanup_old_files, "cron", hour=CLEANUP_HOUR, minute=0,
+        id="cleanup_old_files", replace_existing=True, max_instances=1, coalesce=True, misfire_grace_time=3600
+    )
+    scheduler.start()
 
 async def on_shutdown():
     """Действия при выключении"""
-    scheduler.shutdown()
+    await job_queue.stop()
+    await sd_pool.stop()
+    await progress_reporter.stop()
+    await metrics.stop_server()
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    await state.close()
+    await http_client.shutdown()
     await bot.session.close()
 
+async def run_webhook():
+    """Работа через webhook до сигнала остановки (SIGINT/SIGTERM)"""
+    server = WebhookServer(dp, bot)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остановка по Ctrl+C через отмену задачи
+
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+
 async def main():
     await on_startup()
-    await dp.start_polling(bot)
-    await on_shutdown()
+    try:
+        await metrics.start_server()
+        if RUN_MODE == "webhook":
+            await run_webhook()
+        else:
+            # В режиме polling webhook должен быть снят, иначе getUpdates не работает
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,238 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Awaitable, Optional
+
+from aiohttp import web
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+# Границы корзин гистограмм (сек): от быстрых запросов к БД до минут генерации
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Значения метрики по наборам меток.
+
+    Меняются и из пула потоков (замеры внутри asyncio.to_thread), поэтому
+    изменения и чтение для /metrics идут под блокировкой.
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            if index < len(self.buckets):
+                state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока кода (работает и внутри async-функций)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            values = [(key, dict(state, counts=list(state["counts"]))) for key, state in self._values.items()]
+        lines = self.header()
+        for key, state in values:
+            cumulative = 0
+            labels = _format_labels(self.labelnames, key)
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {state['count']}")
+            lines.append(f"{self.name}_sum{labels} {state['sum']}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]):
+        """Функция, обновляющая значения перед каждым запросом /metrics (например, глубина очереди)"""
+        self._collectors.append(collector)
+
+    async def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception as e:
+                print(f"Ошибка сбора метрик: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "bot_stage_seconds", "Длительность этапов обработки задачи", ("stage",)
+))
+SD_REQUEST_SECONDS = registry.register(Histogram(
+    "bot_sd_request_seconds", "Длительность запросов img2img по серверам SD", ("backend", "outcome")
+))
+JOB_SECONDS = registry.register(Histogram(
+    "bot_job_seconds", "Полное время выполнения задачи воркером", ("outcome",)
+))
+FRAMES_TOTAL = registry.register(Counter(
+    "bot_frames_total", "Сгенерированные и пропущенные кадры", ("outcome",)
+))
+VIDEO_OUTPUT_BYTES = registry.register(Histogram(
+    "bot_video_output_bytes", "Размер готовых файлов по профилям кодирования", ("encoding",),
+    buckets=(64 * 1024, 128 * 1024, 256 * 1024, 512 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2,
+             10 * 1024 ** 2, 20 * 1024 ** 2, 50 * 1024 ** 2)
+))
+QUEUE_DEPTH = registry.register(Gauge(
+    "bot_queue_depth", "Задач в статусе pending"
+))
+JOBS_IN_FLIGHT = registry.register(Gauge(
+    "bot_jobs_in_flight", "Задач, выполняемых воркерами этого процесса"
+))
+SD_IN_FLIGHT = registry.register(Gauge(
+    "bot_sd_in_flight", "Запросов в работе на каждом сервере SD", ("backend",)
+))
+SD_BACKEND_HEALTHY = registry.register(Gauge(
+    "bot_sd_backend_healthy", "1, если сервер SD в пуле", ("backend",)
+))
+SD_RETRIES_TOTAL = registry.register(Counter(
+    "bot_sd_retries_total", "Повторы запросов к SD по типу ошибки", ("reason",)
+))
+SD_HEDGES_TOTAL = registry.register(Counter(
+    "bot_sd_hedges_total", "Дублированные запросы к SD: fired — отправлен, won/lost — дубль ответил первым или нет",
+    ("outcome",)
+))
+SINGLE_FLIGHT_TOTAL = registry.register(Counter(
+    "bot_single_flight_total", "Задачи, запустившие генерацию (leader) или присоединившиеся к идущей (joined)",
+    ("outcome",)
+))
+QUALITY_DECISIONS_TOTAL = registry.register(Counter(
+    "bot_quality_decisions_total", "Выбранные профили качества (reject — отказ из-за перегрузки)", ("profile",)
+))
+RETENTION_DELETED_TOTAL = registry.register(Counter(
+    "bot_retention_deleted_total", "Удалено плановой очисткой", ("kind",)
+))
+RETENTION_RECLAIMED_BYTES = registry.register(Counter(
+    "bot_retention_reclaimed_bytes_total", "Освобождено на диске плановой очисткой"
+))
+WEBHOOK_UPDATES_TOTAL = registry.register(Counter(
+    "bot_webhook_updates_total", "Обновления, пришедшие через webhook", ("outcome",)
+))
+WEBHOOK_QUEUE_DEPTH = registry.register(Gauge(
+    "bot_webhook_queue_depth", "Принятые, но ещё не обработанные обновления"
+))
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=await registry.render(), content_type="text/plain", charset="utf-8")
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start_server():
+    """Локальный HTTP-эндпоинт /metrics в формате Prometheus"""
+    global _runner
+    if not METRICS_ENABLED or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, METRICS_HOST, METRICS_PORT).start()
+    print(f"📊 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
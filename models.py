@@ -32,6 +32,9 @@ class User(Base):
     first_name = Column(String(255))
     last_name = Column(String(255))
     created_at = Column(DateTime, server_default=func.now())
+    # Индивидуальные квоты; NULL — значения по умолчанию из config.py
+    max_concurrent_jobs = Column(Integer)
+    daily_job_limit = Column(Integer)
 
     uploads = relationship("Upload", back_populates="user", cascade="all, delete")
     tasks = relationship("VideoTask", back_populates="user", cascade="all, delete")
@@ -40,8 +43,9 @@ class Upload(Base):
     __tablename__ = 'uploads'
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
-    file_id = Column(String(512), nullable=False)
-    upload_time = Column(DateTime, server_default=func.now())
+    file_id = Column(String(512), nullable=False, index=True)
+    file_unique_id = Column(String(255))
+    upload_time = Column(DateTime, server_default=func.now(), index=True)
     is_photo = Column(String(255))
 
     user = relationship("User", back_populates="uploads")
@@ -54,13 +58,25 @@ class VideoTask(Base):
     status_id = Column(Integer, ForeignKey('task_statuses.id'))
     style_id = Column(Integer, ForeignKey('processing_styles.id'))
     created_at = Column(DateTime, server_default=func.now())
-    completed_at = Column(DateTime)
+    completed_at = Column(DateTime, index=True)
     result_path = Column(String(512))
+    # Очередь задач (job_queue.py)
+    chat_id = Column(BigInteger)
+    progress_message_id = Column(BigInteger)
+    attempts = Column(Integer, nullable=False, default=0)
+    worker_id = Column(String(255))
+    heartbeat_at = Column(DateTime)
+    started_at = Column(DateTime, index=True)
+    quality_profile = Column(String(20))  # Профиль качества, выбранный при постановке (quality.py)
+    # Задача на несколько стилей: родитель (style_id NULL) стоит в очереди,
+    # по дочерней задаче (status grouped) на каждый стиль — с результатом
+    parent_id = Column(Integer, ForeignKey('video_tasks.id'), index=True)
 
     user = relationship("User", back_populates="tasks")
     status = relationship("TaskStatus")
     style = relationship("ProcessingStyle")
     images = relationship("TaskImage", back_populates="task")
+    subtasks = relationship("VideoTask", order_by="VideoTask.id")
 
 class TaskImage(Base):
     __tablename__ = 'task_images'
@@ -71,3 +87,17 @@ class TaskImage(Base):
 
     task = relationship("VideoTask", back_populates="images")
     upload = relationship("Upload", back_populates="task_images")
+
+
+class VideoCache(Base):
+    __tablename__ = 'video_cache'
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String(64), unique=True, nullable=False)
+    result_path = Column(String(512))
+    telegram_file_id = Column(String(512))
+    size_bytes = Column(BigInteger, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    last_used_at = Column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"<VideoCache(id={self.id}, key='{self.cache_key}')>"
@@ -0,0 +1,207 @@
+import asyncio
+from time import time, monotonic
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+
+from config import PROGRESS_GLOBAL_EDITS_PER_SEC, PROGRESS_CHAT_INTERVAL, PROGRESS_HISTORY_SMOOTHING
+
+# Этапы задачи в порядке выполнения (см. generate_ai_video)
+STAGES = ["prepare", "generate", "finalize"]
+
+
+class _TrackedMessage:
+    def __init__(self, chat_id: int, message_id: int):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.started = time()
+        self.progress = 0
+        self.stage = None
+        self.stage_started = self.started
+        self.stage_durations = {}
+        self.queue_position = None
+        self.queue_wait = None
+        self.last_text = None
+
+
+class ProgressReporter:
+    """Обновление сообщений с прогрессом с учётом лимитов Telegram.
+
+    report() только запоминает последнее значение для сообщения, а отправкой
+    занимается один фоновый цикл: промежуточные значения, которые не успели уйти,
+    отбрасываются, правки идут по порядку, а их частота ограничена глобально
+    (PROGRESS_GLOBAL_EDITS_PER_SEC) и для каждого чата (PROGRESS_CHAT_INTERVAL).
+    Оставшееся время считается по средней длительности этапов прошлых задач.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._messages = {}
+        self._dirty = {}  # key -> время первого неотправленного обновления
+        self._chat_next_edit = {}
+        self._stage_history = {}
+        self._tokens = float(PROGRESS_GLOBAL_EDITS_PER_SEC)
+        self._tokens_updated = monotonic()
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def track(self, key, chat_id: int, message_id: Optional[int]):
+        if message_id is not None:
+            self._messages[key] = _TrackedMessage(chat_id, message_id)
+
+    async def report(self, key, progress: int, stage: str = "generate"):
+        message = self._messages.get(key)
+        if not message or progress < message.progress:
+            return
+
+        now = time()
+        if stage != message.stage:
+            if message.stage is not None:
+                message.stage_durations[message.stage] = now - message.stage_started
+            message.stage = stage
+            message.stage_started = now
+        message.progress = progress
+
+        self._dirty.setdefault(key, monotonic())
+        self._wakeup.set()
+
+    async def report_queued(self, key, position: int, wait_seconds: int):
+        """Задача ещё ждёт в очереди: показать место и примерное время до начала"""
+        message = self._messages.get(key)
+        if not message or message.stage is not None:
+            return
+        if (message.queue_position, message.queue_wait) == (position, wait_seconds):
+            return
+        message.queue_position = position
+        message.queue_wait = wait_seconds
+        self._dirty.setdefault(key, monotonic())
+        self._wakeup.set()
+
+    def finish(self, key, success: bool = True):
+        """Задача завершена: снять сообщение с учёта и запомнить длительности этапов"""
+        message = self._messages.pop(key, None)
+        self._dirty.pop(key, None)
+        if not message or not success:
+            return
+
+        if message.stage is not None:
+            message.stage_durations[message.stage] = time() - message.stage_started
+        for stage, duration in message.stage_durations.items():
+            average = self._stage_history.get(stage)
+            if average is None:
+                self._stage_history[stage] = duration
+            else:
+                self._stage_history[stage] = average + PROGRESS_HISTORY_SMOOTHING * (duration - average)
+
+    def estimate_remaining(self, message: _TrackedMessage) -> int:
+        """Оставшееся время (сек) по истории этапов; без истории — линейная оценка"""
+        now = time()
+        if message.stage not in STAGES or message.stage not in self._stage_history:
+            elapsed = now - message.started
+            return int((100 - message.progress) * elapsed / max(1, message.progress))
+
+        in_stage = now - message.stage_started
+        remaining = max(self._stage_history[message.stage] - in_stage, 0)
+        for stage in STAGES[STAGES.index(message.stage) + 1:]:
+            remaining += self._stage_history.get(stage, 0)
+        return int(remaining)
+
+    def render(self, message: _TrackedMessage) -> str:
+        if message.stage is None and message.queue_position is not None:
+            wait = message.queue_wait or 0
+            return (
+                f"⏳ Задача в очереди, место: ~{message.queue_position}\n"
+                f"🕒 Начнём примерно через {wait // 60} мин {wait % 60} сек"
+            )
+        elapsed = int(time() - message.started)
+        remaining = self.estimate_remaining(message)
+        return (
+            f"🔄 Прогресс: {message.progress}%\n"
+            f"⏱ Прошло: {elapsed // 60} мин {elapsed % 60} сек\n"
+            f"⏳ Осталось: ~{remaining // 60} мин {remaining % 60} сек"
+        )
+
+    def _take_token(self, now: float) -> bool:
+        self._tokens = min(
+            float(PROGRESS_GLOBAL_EDITS_PER_SEC),
+            self._tokens + (now - self._tokens_updated) * PROGRESS_GLOBAL_EDITS_PER_SEC
+        )
+        self._tokens_updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _edit(self, message: _TrackedMessage):
+        text = self.render(message)
+        if text == message.last_text:
+            return
+        try:
+            await self.bot.edit_message_text(chat_id=message.chat_id, message_id=message.message_id, text=text)
+            message.last_text = text
+        except TelegramRetryAfter as e:
+            # Telegram сам сказал, сколько ждать — притормаживаем все правки
+            self._paused_until = monotonic() + e.retry_after
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                print(f"Ошибка обновления прогресса: {str(e)}")
+        except Exception as e:
+            print(f"Ошибка обновления прогресса: {str(e)}")
+
+    async def _run(self):
+        while True:
+            if not self._dirty:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            now = monotonic()
+            next_wake = self._paused_until if now < self._paused_until else float("inf")
+
+            if now >= self._paused_until:
+                # Сначала те сообщения, что ждут дольше всех
+                for key, _ in sorted(self._dirty.items(), key=lambda item: item[1]):
+                    message = self._messages.get(key)
+                    if not message:
+                        self._dirty.pop(key, None)
+                        continue
+
+                    allowed_at = self._chat_next_edit.get(message.chat_id, 0)
+                    if allowed_at > now:
+                        next_wake = min(next_wake, allowed_at)
+                        continue
+                    if not self._take_token(now):
+                        next_wake = min(next_wake, now + 1 / PROGRESS_GLOBAL_EDITS_PER_SEC)
+                        break
+
+                    self._dirty.pop(key, None)
+                    self._chat_next_edit[message.chat_id] = now + PROGRESS_CHAT_INTERVAL
+                    await self._edit(message)
+                    now = monotonic()
+
+            if not self._dirty:
+                self._chat_next_edit = {
+                    chat_id: allowed_at for chat_id, allowed_at in self._chat_next_edit.items() if allowed_at > now
+                }
+                continue
+            if next_wake == float("inf"):
+                # Обновления пришли, пока шла отправка, — сразу на следующий круг
+                continue
+
+            # Ждём, пока освободится лимит, или нового обновления
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(next_wake - monotonic(), 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,62 @@
+import math
+from typing import Optional
+
+from ai_processing import quality_profile, request_cost, sd_pool
+from metrics import QUALITY_DECISIONS_TOTAL
+from config import (QUALITY_PROFILES, QUALITY_DEFAULT_PROFILE, QUALITY_ADAPTIVE, QUALITY_LATENCY_SLO,
+                    QUALITY_REJECT_FACTOR, QUEUE_ESTIMATED_JOB_SECONDS, SD_BATCH_MODE, SD_BATCH_SIZE,
+                    SD_JOB_CONCURRENCY)
+
+
+class QualityDecision:
+    def __init__(self, profile: Optional[str], estimate: float, retry_after: int = 0):
+        self.profile = profile  # None — задачу не принимаем
+        self.estimate = estimate  # Ожидаемое время до готового видео (сек)
+        self.retry_after = retry_after
+
+    def __repr__(self):
+        return f"<QualityDecision(profile={self.profile}, estimate={self.estimate:.0f})>"
+
+
+def _job_cost(profile: dict) -> float:
+    """Объём работы одной задачи с учётом пачек и параллельных запросов внутри задачи"""
+    batch = min(max(1, SD_BATCH_SIZE) if SD_BATCH_MODE else 1, profile["frames"])
+    requests = math.ceil(profile["frames"] / batch)
+    waves = math.ceil(requests / max(1, SD_JOB_CONCURRENCY))
+    return waves * request_cost(profile["steps"], profile["width"], profile["height"], batch)
+
+
+def estimate_generation_seconds(profile: dict) -> float:
+    """Сколько займёт генерация по профилю при текущей скорости серверов SD"""
+    if sd_pool.unit_latency is not None:
+        return _job_cost(profile) * sd_pool.unit_latency
+    # Замеров ещё нет — масштабируем начальную оценку по объёму работы
+    return QUEUE_ESTIMATED_JOB_SECONDS * _job_cost(profile) / _job_cost(quality_profile())
+
+
+def choose_profile(pending: int, workers: int, average_job_seconds: float, styles: int = 1) -> QualityDecision:
+    """Лучший профиль, при котором задача уложится в QUALITY_LATENCY_SLO.
+
+    Ожидание в очереди оценивается по числу задач перед новой и средней
+    длительности задачи, генерация — по скорости SD на единицу работы.
+    Если даже худший профиль превышает SLO больше чем в QUALITY_REJECT_FACTOR
+    раз, задача не принимается, а пользователь получает время для повтора.
+    Задача на styles стилей генерируется под лимитом одной задачи, то есть в styles раз дольше.
+    """
+    if not QUALITY_ADAPTIVE:
+        return QualityDecision(QUALITY_DEFAULT_PROFILE, 0)
+
+    wait = pending / max(1, workers) * average_job_seconds
+    estimate = 0.0
+    for name in QUALITY_PROFILES:
+        estimate = wait + estimate_generation_seconds(quality_profile(name)) * styles
+        if estimate <= QUALITY_LATENCY_SLO:
+            QUALITY_DECISIONS_TOTAL.inc(profile=name)
+            return QualityDecision(name, estimate)
+
+    if estimate <= QUALITY_LATENCY_SLO * QUALITY_REJECT_FACTOR:
+        QUALITY_DECISIONS_TOTAL.inc(profile=name)
+        return QualityDecision(name, estimate)
+
+    QUALITY_DECISIONS_TOTAL.inc(profile="reject")
+    return QualityDecision(None, estimate, retry_after=int(estimate - QUALITY_LATENCY_SLO))
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, exists
+
+from models import Upload, VideoTask, TaskImage, VideoCache
+from session import async_session
+from metrics import RETENTION_DELETED_TOTAL, RETENTION_RECLAIMED_BYTES
+from job_queue import STATUS_PENDING, STATUS_PROCESSING, STATUS_COMPLETED, STATUS_FAILED, STATUS_GROUPED
+import video_cache
+from config import (
+    FILE_LIFETIME_DAYS, OUTPUT_DIR, TEMP_DIR, CHECKPOINT_DIR,
+    RETENTION_CHUNK_SIZE, RETENTION_CHUNK_PAUSE, RETENTION_FILE_GRACE, RETENTION_TEMP_MAX_AGE
+)
+
+
+async def _delete_in_chunks(select_ids, delete_chunk) -> int:
+    """Удаление порциями по RETENTION_CHUNK_SIZE: каждая порция — своя короткая транзакция"""
+    total = 0
+    while True:
+        async with async_session() as session:
+            ids = (await session.execute(select_ids.limit(RETENTION_CHUNK_SIZE))).scalars().all()
+            if not ids:
+                return total
+            await delete_chunk(session, ids)
+            await session.commit()
+        total += len(ids)
+        if len(ids) < RETENTION_CHUNK_SIZE:
+            return total
+        await asyncio.sleep(RETENTION_CHUNK_PAUSE)
+
+
+async def delete_old_tasks(cutoff: datetime) -> int:
+    """Завершённые и проваленные задачи, закрытые раньше cutoff (по индексу completed_at)"""
+    async def delete_chunk(session, ids):
+        # Вместе с задачей на несколько стилей — её задачи по стилям
+        subtasks = select(VideoTask.id).where(VideoTask.parent_id.in_(ids))
+        await session.execute(delete(TaskImage).where(TaskImage.task_id.in_(ids) | TaskImage.task_id.in_(subtasks)))
+        await session.execute(delete(VideoTask).where(VideoTask.parent_id.in_(ids)))
+        await session.execute(delete(VideoTask).where(VideoTask.id.in_(ids)))
+
+    return await _delete_in_chunks(
+        select(VideoTask.id)
+        .where(VideoTask.completed_at < cutoff, VideoTask.status_id.in_([STATUS_COMPLETED, STATUS_FAILED]))
+        .order_by(VideoTask.completed_at),
+        delete_chunk
+    )
+
+
+async def delete_old_uploads(cutoff: datetime) -> int:
+    """Загрузки старше cutoff (по индексу upload_time), кроме фото задач, которые ещё в очереди или в работе"""
+    active = (
+        select(TaskImage.id)
+        .join(VideoTask, VideoTask.id == TaskImage.task_id)
+        .where(TaskImage.upload_id == Upload.id,
+               VideoTask.status_id.in_([STATUS_PENDING, STATUS_PROCESSING]))
+    )
+
+    async def delete_chunk(session, ids):
+        await session.execute(delete(TaskImage).where(TaskImage.upload_id.in_(ids)))
+        await session.execute(delete(Upload).where(Upload.id.in_(ids)))
+
+    return await _delete_in_chunks(
+        select(Upload.id).where(Upload.upload_time < cutoff, ~exists(active)).order_by(Upload.upload_time),
+        delete_chunk
+    )
+
+
+async def referenced_files() -> set:
+    """Файлы, на которые ещё ссылаются задачи или кэш"""
+    async with async_session() as session:
+        paths = set((await session.execute(
+            select(VideoTask.result_path).where(VideoTask.result_path.is_not(None)).distinct()
+        )).scalars())
+        paths.update((await session.execute(
+            select(VideoCache.result_path).where(VideoCache.result_path.is_not(None))
+        )).scalars())
+    return {os.path.abspath(path) for path in paths}
+
+
+def _newest_mtime(path: str) -> float:
+    newest = os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                pass
+    return newest
+
+
+def _tree_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def sweep_output(referenced: set) -> tuple:
+    """Видео в OUTPUT_DIR, на которые не ссылается ни одна задача; возвращает (файлов, байт)"""
+    if not os.path.isdir(OUTPUT_DIR):
+        return 0, 0
+    removed, reclaimed = 0, 0
+    now = time.time()
+    for entry in os.scandir(OUTPUT_DIR):
+        path = os.path.abspath(entry.path)
+        try:
+            if not entry.is_file() or path in referenced or now - entry.stat().st_mtime < RETENTION_FILE_GRACE:
+                continue
+            size = entry.stat().st_size
+            os.remove(path)
+        except OSError as e:
+            print(f"Не удалось удалить {path}: {e}")
+            continue
+        removed += 1
+        reclaimed += size
+    return removed, reclaimed
+
+
+def sweep_temp() -> tuple:
+    """Брошенные временные папки задач (например, после падения процесса); возвращает (папок, байт)"""
+    if not os.path.isdir(TEMP_DIR):
+        return 0, 0
+    removed, reclaimed = 0, 0
+    now = time.time()
+    for entry in os.scandir(TEMP_DIR):
+        try:
+            if now - _newest_mtime(entry.path) < RETENTION_TEMP_MAX_AGE:
+                continue
+            size = _tree_size(entry.path)
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+        except OSError as e:
+            print(f"Не удалось удалить {entry.path}: {e}")
+            continue
+        removed += 1
+        reclaimed += size
+    return removed, reclaimed
+
+
+async def active_task_ids() -> set:
+    """Задачи в очереди или в работе (и стили таких задач): их контрольные точки ещё понадобятся"""
+    async with async_session() as session:
+        return set((await session.execute(
+            select(VideoTask.id).where(VideoTask.status_id.in_([STATUS_PENDING, STATUS_PROCESSING, STATUS_GROUPED]))
+        )).scalars())
+
+
+def sweep_checkpoints(active: set) -> tuple:
+    """Контрольные точки завершённых, проваленных и удалённых задач; возвращает (папок, байт)"""
+    if not os.path.isdir(CHECKPOINT_DIR):
+        return 0, 0
+    removed, reclaimed = 0, 0
+    for entry in os.scandir(CHECKPOINT_DIR):
+        try:
+            task_id = int(entry.name.split("_", 1)[1])
+        except (IndexError, ValueError):
+            continue
+        if task_id in active:
+            continue
+        try:
+            # Задача могла начаться уже после выборки активных
+            if time.time() - _newest_mtime(entry.path) < RETENTION_FILE_GRACE:
+                continue
+        except OSError:
+            continue
+        try:
+            size = _tree_size(entry.path)
+            shutil.rmtree(entry.path)
+        except OSError as e:
+            print(f"Не удалось удалить {entry.path}: {e}")
+            continue
+        removed += 1
+        reclaimed += size
+    return removed, reclaimed
+
+
+async def run_retention() -> dict:
+    """Ежедневная очистка: старые задачи и загрузки в БД, кэш, лишние файлы в OUTPUT_DIR и TEMP_DIR"""
+    started = time.perf_counter()
+    cutoff = datetime.now() - timedelta(days=FILE_LIFETIME_DAYS)
+    report = {"tasks": 0, "uploads": 0, "cache": 0, "output_files": 0, "temp_dirs": 0, "checkpoints": 0, "bytes": 0}
+
+    report["tasks"] = await delete_old_tasks(cutoff)
+    report["uploads"] = await delete_old_uploads(cutoff)
+    report["cache"] = await video_cache.evict()
+
+    # Файлы проверяем после БД: ссылки удалённых задач уже не считаются
+    referenced = await referenced_files()
+    report["output_files"], output_bytes = await asyncio.to_thread(sweep_output, referenced)
+    report["temp_dirs"], temp_bytes = await asyncio.to_thread(sweep_temp)
+    report["checkpoints"], checkpoint_bytes = await asyncio.to_thread(sweep_checkpoints, await active_task_ids())
+    report["bytes"] = output_bytes + temp_bytes + checkpoint_bytes
+
+    for kind in ("tasks", "uploads", "cache", "output_files", "temp_dirs", "checkpoints"):
+        RETENTION_DELETED_TOTAL.inc(report[kind], kind=kind)
+    RETENTION_RECLAIMED_BYTES.inc(report["bytes"])
+
+    print(
+        f"🧹 Очистка за {time.perf_counter() - started:.1f} сек: задач {report['tasks']}, "
+        f"загрузок {report['uploads']}, записей кэша {report['cache']}, видео {report['output_files']}, "
+        f"временных папок {report['temp_dirs']}, контрольных точек {report['checkpoints']}, освобождено {report['bytes'] / 1024 ** 2:.1f} МБ"
+    )
+    return report
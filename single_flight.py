@@ -0,0 +1,71 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from metrics import SINGLE_FLIGHT_TOTAL
+
+
+class _Flight:
+    def __init__(self):
+        self.task = None
+        self.listeners = []
+        self.last_progress = None
+        self.waiters = 0
+
+    async def broadcast(self, *args):
+        """Прогресс общей генерации — каждому присоединившемуся"""
+        self.last_progress = args
+        for listener in list(self.listeners):
+            try:
+                await listener(*args)
+            except Exception as e:
+                print(f"Ошибка обновления прогресса: {e}")
+
+
+class SingleFlight:
+    """Одна генерация на одинаковые задачи, выполняющиеся одновременно.
+
+    Первая задача с ключом запускает fn, следующие с тем же ключом не
+    запускают свою, а ждут результата первой и получают её прогресс (с
+    последнего известного значения). Генерация идёт отдельной задачей asyncio:
+    отмена одного участника её не прерывает, она отменяется, только когда
+    ждать результата больше некому. Ключи живут только в этом процессе.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    async def run(self, key: str, fn: Callable[[Callable[..., Awaitable[None]]], Awaitable],
+                  on_progress: Optional[Callable[..., Awaitable[None]]] = None) -> tuple:
+        """Возвращает (результат fn, True — если генерацию запустил этот вызов)"""
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._execute(key, flight, fn))
+        SINGLE_FLIGHT_TOTAL.inc(outcome="leader" if leader else "joined")
+
+        flight.waiters += 1
+        if on_progress:
+            flight.listeners.append(on_progress)
+            if flight.last_progress:
+                await on_progress(*flight.last_progress)
+        try:
+            return await asyncio.shield(flight.task), leader
+        finally:
+            flight.waiters -= 1
+            if on_progress:
+                flight.listeners.remove(on_progress)
+            if not flight.waiters and not flight.task.done():
+                flight.task.cancel()
+
+    async def _execute(self, key: str, flight: _Flight, fn):
+        try:
+            return await fn(flight.broadcast)
+        finally:
+            # Следующая задача с этим ключом начнёт новую генерацию (или возьмёт видео из кэша)
+            if self._flights.get(key) is flight:
+                del self._flights[key]
@@ -0,0 +1,214 @@
+import asyncio
+import json
+from time import monotonic
+from typing import Optional
+from urllib.parse import urlparse
+
+from config import STATE_BACKEND, STATE_REDIS_URL, STATE_REDIS_POOL_SIZE, STATE_KEY_PREFIX
+
+
+class StateStoreError(Exception):
+    pass
+
+
+class StateStore:
+    """Хранилище временного состояния пользователей (загруженное фото, замок выбора стиля).
+
+    Значения — словари, сериализуемые в JSON; ttl в секундах, после него ключ
+    пропадает сам. Изменения нужно записывать обратно через set(): get()
+    возвращает копию, как было бы и с внешним хранилищем.
+    """
+
+    async def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: dict, ttl: Optional[int] = None):
+        raise NotImplementedError
+
+    async def set_if_absent(self, key: str, value: dict, ttl: Optional[int] = None) -> bool:
+        """Записать, только если ключа нет; True — если записали (замок между процессами)"""
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def ping(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """Состояние в памяти процесса: для одного экземпляра бота"""
+
+    def __init__(self):
+        self._data = {}  # key -> (время истечения или None, JSON)
+
+    def _purge(self, now: float):
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._data[key]
+
+    def _alive(self, key: str, now: float) -> bool:
+        item = self._data.get(key)
+        if item is None:
+            return False
+        if item[0] is not None and item[0] <= now:
+            del self._data[key]
+            return False
+        return True
+
+    async def get(self, key: str) -> Optional[dict]:
+        if not self._alive(key, monotonic()):
+            return None
+        return json.loads(self._data[key][1])
+
+    async def set(self, key: str, value: dict, ttl: Optional[int] = None):
+        now = monotonic()
+        self._purge(now)
+        self._data[key] = (now + ttl if ttl else None, json.dumps(value))
+
+    async def set_if_absent(self, key: str, value: dict, ttl: Optional[int] = None) -> bool:
+        if self._alive(key, monotonic()):
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+
+class _RedisConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def execute(self, *args):
+        """Команда в формате RESP; ошибка Redis возвращается как StateStoreError, а не бросается"""
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self.writer.write(b"".join(parts))
+        await self.writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self):
+        line = await self.reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            return StateStoreError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Неизвестный ответ Redis: {line!r}")
+
+    def close(self):
+        self.writer.close()
+
+
+class RedisStateStore(StateStore):
+    """Состояние в Redis (или любом сервере с протоколом Redis): общее для всех экземпляров бота.
+
+    Минимальный клиент RESP поверх asyncio без внешних зависимостей: нужны
+    только GET, SET (EX/NX), DEL и PING. Адрес — redis://[:пароль@]хост:порт/база.
+    """
+
+    def __init__(self, url: str, prefix: str = "", pool_size: int = 4):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def _connect(self) -> _RedisConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = _RedisConnection(reader, writer)
+        try:
+            if self.password:
+                self._check(await connection.execute("AUTH", self.password))
+            if self.db:
+                self._check(await connection.execute("SELECT", self.db))
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    @staticmethod
+    def _check(reply):
+        if isinstance(reply, StateStoreError):
+            raise reply
+        return reply
+
+    async def _execute(self, *args):
+        async with self._slots:
+            while True:
+                reused = bool(self._idle)
+                connection = self._idle.pop() if reused else await self._connect()
+                try:
+                    reply = await connection.execute(*args)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection.close()
+                    # Соединение из пула могло закрыться, пока простаивало (перезапуск Redis,
+                    # timeout на сервере) — повторяем на следующем; ошибку нового соединения отдаём
+                    if not reused:
+                        raise
+                except BaseException:
+                    # Соединение в неизвестном состоянии — не возвращаем его в пул
+                    connection.close()
+                    raise
+            self._idle.append(connection)
+        return self._check(reply)
+
+    async def get(self, key: str) -> Optional[dict]:
+        data = await self._execute("GET", self.prefix + key)
+        return json.loads(data) if data is not None else None
+
+    async def set(self, key: str, value: dict, ttl: Optional[int] = None):
+        args = ["SET", self.prefix + key, json.dumps(value)]
+        if ttl:
+            args += ["EX", int(ttl)]
+        await self._execute(*args)
+
+    async def set_if_absent(self, key: str, value: dict, ttl: Optional[int] = None) -> bool:
+        args = ["SET", self.prefix + key, json.dumps(value), "NX"]
+        if ttl:
+            args += ["EX", int(ttl)]
+        return await self._execute(*args) is not None
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._execute("DEL", *(self.prefix + key for key in keys))
+
+    async def ping(self):
+        await self._execute("PING")
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def create_state_store() -> StateStore:
+    if STATE_BACKEND == "redis":
+        return RedisStateStore(STATE_REDIS_URL, prefix=STATE_KEY_PREFIX, pool_size=STATE_REDIS_POOL_SIZE)
+    if STATE_BACKEND == "memory":
+        return MemoryStateStore()
+    raise StateStoreError(f"Неизвестное хранилище состояния: {STATE_BACKEND}")
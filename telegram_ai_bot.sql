@@ -61,10 +61,13 @@ CREATE TABLE `uploads` (
   `id` int NOT NULL AUTO_INCREMENT,
   `user_id` int NOT NULL,
   `file_id` varchar(512) NOT NULL,
+  `file_unique_id` varchar(255) DEFAULT NULL,
   `upload_time` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
   `is_photo` varchar(255) DEFAULT NULL,
   PRIMARY KEY (`id`),
   KEY `user_id` (`user_id`),
+  KEY `upload_time` (`upload_time`),
+  KEY `file_id` (`file_id`),
   CONSTRAINT `uploads_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -81,12 +84,32 @@ CREATE TABLE `users` (
   `first_name` varchar(255) DEFAULT NULL,
   `last_name` varchar(255) DEFAULT NULL,
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `max_concurrent_jobs` int DEFAULT NULL,
+  `daily_job_limit` int DEFAULT NULL,
   PRIMARY KEY (`id`),
   UNIQUE KEY `telegram_id` (`telegram_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
 
+DROP TABLE IF EXISTS `video_cache`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `video_cache` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `cache_key` varchar(64) NOT NULL,
+  `result_path` varchar(512) DEFAULT NULL,
+  `telegram_file_id` varchar(512) DEFAULT NULL,
+  `size_bytes` bigint DEFAULT '0',
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `last_used_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `cache_key` (`cache_key`),
+  KEY `last_used_at` (`last_used_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+
 DROP TABLE IF EXISTS `video_tasks`;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
 /*!50503 SET character_set_client = utf8mb4 */;
@@ -94,17 +117,31 @@ CREATE TABLE `video_tasks` (
   `id` int NOT NULL AUTO_INCREMENT,
   `user_id` int NOT NULL,
   `status_id` int NOT NULL,
-  `style_id` int NOT NULL,
+  `style_id` int DEFAULT NULL,
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
   `completed_at` timestamp NULL DEFAULT NULL,
   `result_path` varchar(512) DEFAULT NULL,
+  `chat_id` bigint DEFAULT NULL,
+  `progress_message_id` bigint DEFAULT NULL,
+  `attempts` int NOT NULL DEFAULT '0',
+  `worker_id` varchar(255) DEFAULT NULL,
+  `heartbeat_at` timestamp NULL DEFAULT NULL,
+  `started_at` timestamp NULL DEFAULT NULL,
+  `quality_profile` varchar(20) DEFAULT NULL,
+  `parent_id` int DEFAULT NULL,
   PRIMARY KEY (`id`),
   KEY `user_id` (`user_id`),
   KEY `status_id` (`status_id`),
+  KEY `status_created` (`status_id`,`created_at`),
+  KEY `user_status` (`user_id`,`status_id`),
+  KEY `completed_at` (`completed_at`),
+  KEY `started_at` (`started_at`),
   KEY `style_id` (`style_id`),
+  KEY `parent_id` (`parent_id`),
   CONSTRAINT `video_tasks_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE,
   CONSTRAINT `video_tasks_ibfk_2` FOREIGN KEY (`status_id`) REFERENCES `task_statuses` (`id`),
-  CONSTRAINT `video_tasks_ibfk_3` FOREIGN KEY (`style_id`) REFERENCES `processing_styles` (`id`)
+  CONSTRAINT `video_tasks_ibfk_3` FOREIGN KEY (`style_id`) REFERENCES `processing_styles` (`id`),
+  CONSTRAINT `video_tasks_ibfk_4` FOREIGN KEY (`parent_id`) REFERENCES `video_tasks` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
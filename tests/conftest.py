@@ -0,0 +1,29 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# БД для тестов — временный SQLite (как в бенчмарке); задаётся до импорта session
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(prefix='tests_'), 'test.db')}")
+
+
+@pytest.fixture
+def database():
+    """Пустая схема в тестовой БД; соединения пула закрываются до и после теста"""
+    from models import Base
+    from session import engine
+
+    async def reset():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        await engine.dispose()
+
+    asyncio.run(reset())
+    yield
+    asyncio.run(engine.dispose())
@@ -0,0 +1,26 @@
+"""Кэш справочников в памяти процесса (SQLite)"""
+import asyncio
+
+from db_cache import ReferenceCache
+from models import ProcessingStyle
+from session import async_session
+
+
+def test_styles_survive_rollback_of_loading_session(database):
+    async def main():
+        references = ReferenceCache()
+        async with async_session() as session:
+            session.add_all([ProcessingStyle(style_name="Anime"), ProcessingStyle(style_name="Sketch")])
+            await session.commit()
+
+        # Справочник перечитывается внутри обработчика, который потом откатывает свою сессию
+        async with async_session() as session:
+            assert [style.style_name for style in await references.styles(session)] == ["Anime", "Sketch"]
+            await session.rollback()
+
+        async with async_session() as session:
+            styles = await references.styles(session)
+            assert [(style.id, style.style_name) for style in styles] == [(1, "Anime"), (2, "Sketch")]
+            assert (await references.style(session, 2)).style_name == "Sketch"
+            assert await references.style(session, 3) is None
+    asyncio.run(main())
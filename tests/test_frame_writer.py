@@ -0,0 +1,96 @@
+"""OrderedFrameWriter: порядок кадров для энкодера и окно, ограничивающее генерацию"""
+import asyncio
+
+import ai_processing
+from ai_processing import OrderedFrameWriter, quality_profile
+from config import FRAME_PIPELINE_WINDOW, SD_JOB_CONCURRENCY
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.frames = []
+
+    @property
+    def frames_written(self) -> int:
+        return len(self.frames)
+
+    async def write_frame(self, frame_data: str):
+        self.frames.append(frame_data)
+
+
+async def blocked(awaitable, timeout: float = 0.05) -> bool:
+    """True, если awaitable не завершился за timeout (и он отменён)"""
+    task = asyncio.ensure_future(awaitable)
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if done:
+        return False
+    task.cancel()
+    return True
+
+
+def test_frames_written_in_order_and_gaps_skipped():
+    async def main():
+        encoder = FakeEncoder()
+        written = []
+
+        async def on_written(count: int):
+            written.append(count)
+
+        writer = OrderedFrameWriter(encoder, on_written, window=8)
+        await writer.put(2, "c")
+        await writer.put(1, None)
+        assert encoder.frames == []
+        await writer.put(0, "a")
+        await writer.put(3, "d")
+        assert encoder.frames == ["a", "c", "d"]
+        assert written == [1, 2, 3]
+    asyncio.run(main())
+
+
+def test_wait_for_room_blocks_when_window_is_full():
+    async def main():
+        writer = OrderedFrameWriter(FakeEncoder(), window=2)
+        await writer.wait_for_room(0)
+        await writer.wait_for_room(1)
+        assert await blocked(writer.wait_for_room(2))
+
+        # Кадр, пришедший раньше очереди, окно не сдвигает
+        await writer.put(1, "b")
+        assert await blocked(writer.wait_for_room(2))
+
+        waiter = asyncio.create_task(writer.wait_for_room(3))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await writer.put(0, "a")
+        await asyncio.wait_for(waiter, 1)
+        assert await blocked(writer.wait_for_room(4))
+    asyncio.run(main())
+
+
+def test_full_window_keeps_job_concurrency(monkeypatch):
+    """Окно по умолчанию не урезает параллельность задачи: при заполненном окне
+    всё равно идёт SD_JOB_CONCURRENCY пакетов сразу, но не дальше окна от энкодера"""
+    async def main():
+        monkeypatch.setattr(ai_processing, "_sd_semaphore", asyncio.Semaphore(SD_JOB_CONCURRENCY))
+        encoder = FakeEncoder()
+        writer = OrderedFrameWriter(encoder, window=FRAME_PIPELINE_WINDOW)
+        in_flight, max_in_flight, ahead = 0, 0, []
+
+        async def fake_batch(img_base64, style, first_frame, count, seed, profile=None, deadline=None):
+            nonlocal in_flight, max_in_flight
+            ahead.append(first_frame - encoder.frames_written)
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            return [f"frame{first_frame + i}" for i in range(count)]
+
+        monkeypatch.setattr(ai_processing, "generate_sd_batch", fake_batch)
+        # Ролик в несколько окон — окно заполняется
+        profile = dict(quality_profile(), frames=FRAME_PIPELINE_WINDOW * 3)
+        await ai_processing.generate_frames_concurrently("aGk=", "anime", frame_sink=writer, profile=profile)
+
+        assert max_in_flight == SD_JOB_CONCURRENCY
+        assert max(ahead) < FRAME_PIPELINE_WINDOW
+        assert encoder.frames == [f"frame{i}" for i in range(profile["frames"])]
+    asyncio.run(main())
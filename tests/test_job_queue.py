@@ -0,0 +1,92 @@
+"""Справедливая очередь: порядок claim(), лимит задач пользователя и queue_positions() (SQLite)"""
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from job_queue import JobQueue, STATUS_COMPLETED, STATUS_PENDING
+from models import User, VideoTask
+from session import async_session
+
+
+async def handler(task_id: int):
+    pass
+
+
+async def add_tasks(counts: dict, max_concurrent_jobs=None) -> dict:
+    """Пользователи с задачами в pending (создаются по порядку); возвращает имя -> id задач"""
+    created = datetime.now() - timedelta(minutes=10)
+    tasks = {}
+    async with async_session() as session:
+        for index, (name, count) in enumerate(counts.items()):
+            user = User(telegram_id=index + 1, username=name, max_concurrent_jobs=max_concurrent_jobs)
+            session.add(user)
+            tasks[name] = [VideoTask(user=user, status_id=STATUS_PENDING, attempts=0,
+                                     created_at=created + timedelta(seconds=len(tasks) * 10 + i))
+                           for i in range(count)]
+            session.add_all(tasks[name])
+        await session.commit()
+    return {name: [task.id for task in items] for name, items in tasks.items()}
+
+
+async def complete(task_id: int):
+    async with async_session() as session:
+        await session.execute(update(VideoTask).where(VideoTask.id == task_id).values(status_id=STATUS_COMPLETED))
+        await session.commit()
+
+
+async def claim_all(queue: JobQueue) -> list:
+    claimed = []
+    while (task_id := await queue.claim()) is not None:
+        claimed.append(task_id)
+    return claimed
+
+
+def test_claims_go_round_robin_between_users(database):
+    async def main():
+        tasks = await add_tasks({"a": 3, "b": 2, "c": 1}, max_concurrent_jobs=10)
+        queue = JobQueue(handler)
+        positions = await queue.queue_positions()
+
+        claimed = await claim_all(queue)
+        a, b, c = tasks["a"], tasks["b"], tasks["c"]
+        assert claimed == [a[0], b[0], c[0], a[1], b[1], a[2]]
+        # Места в очереди совпадают с порядком захвата
+        assert sorted(positions, key=lambda task_id: positions[task_id][0]) == claimed
+        assert [positions[task_id][0] for task_id in claimed] == list(range(1, 7))
+    asyncio.run(main())
+
+
+def test_per_user_concurrency_limit(database):
+    async def main():
+        tasks = await add_tasks({"heavy": 3, "light": 1})
+        queue = JobQueue(handler)
+        heavy, light = tasks["heavy"], tasks["light"]
+
+        # По умолчанию (QUOTA_CONCURRENT_JOBS = 1) у каждого одна задача в работе
+        assert await claim_all(queue) == [heavy[0], light[0]]
+        positions = await queue.queue_positions()
+        assert list(positions) == [heavy[1], heavy[2]]
+
+        await complete(heavy[0])
+        assert await claim_all(queue) == [heavy[1]]
+        await complete(light[0])
+        assert await claim_all(queue) == []
+        await complete(heavy[1])
+        assert await claim_all(queue) == [heavy[2]]
+    asyncio.run(main())
+
+
+def test_positions_put_users_at_their_limit_last(database):
+    async def main():
+        tasks = await add_tasks({"busy": 2, "waiting": 2})
+        queue = JobQueue(handler)
+        busy, waiting = tasks["busy"], tasks["waiting"]
+        assert await queue.claim() == busy[0]
+
+        positions = await queue.queue_positions()
+        order = sorted(positions, key=lambda task_id: positions[task_id][0])
+        assert order == [waiting[0], busy[1], waiting[1]]
+        # Следующий захват — первая задача по местам
+        assert await queue.claim() == order[0]
+    asyncio.run(main())
@@ -0,0 +1,215 @@
+"""Пул серверов SD: исключение узла после ошибок, возврат проверкой здоровья, повторы,
+хеджирование и срок генерации (заглушки SD из бенчмарка)"""
+import asyncio
+
+import pytest
+
+import ai_processing
+import http_client
+from ai_processing import (SDBackendError, SDBackendPool, SDRequestError, SD_REQUEST_TIMEOUT, build_sd_params,
+                           request_img2img, _img2img_once)
+from benchmarks.stub_servers import StubSDServer
+from config import SD_EJECT_AFTER_FAILURES
+
+
+@pytest.fixture(autouse=True)
+def fast_pool(monkeypatch):
+    monkeypatch.setattr(ai_processing, "SD_HEALTH_CHECK_INTERVAL", 0.05)
+    monkeypatch.setattr(ai_processing, "SD_HEALTH_TIMEOUT", 1)
+    monkeypatch.setattr(ai_processing, "SD_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(ai_processing, "SD_HEDGE_ENABLED", False)
+
+
+def run_with_servers(test, monkeypatch, count: int = 2):
+    async def main():
+        servers = [StubSDServer(latency=0.01, jitter=0) for _ in range(count)]
+        for server in servers:
+            await server.start()
+        pool = SDBackendPool([server.url for server in servers])
+        monkeypatch.setattr(ai_processing, "sd_pool", pool)
+        try:
+            await test(pool, servers)
+        finally:
+            await pool.stop()
+            await http_client.shutdown()
+            for server in servers:
+                await server.stop()
+    asyncio.run(main())
+
+
+async def wait_until(condition, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "условие не выполнилось за отведённое время"
+        await asyncio.sleep(0.01)
+
+
+def params():
+    return build_sd_params("aGk=", "anime", "test", seed=1)
+
+
+async def request_avoiding(url: str):
+    """Запрос мимо узла url — пока есть другой здоровый узел"""
+    return await _img2img_once(params(), 1.0, SD_REQUEST_TIMEOUT, [url])
+
+
+def test_backend_ejected_after_consecutive_failures(monkeypatch):
+    async def test(pool, servers):
+        bad, good = servers
+        bad.error_rate = 1.0
+        bad_backend = pool.backends[0]
+        for _ in range(SD_EJECT_AFTER_FAILURES):
+            with pytest.raises(SDBackendError):
+                await request_avoiding(good.url)
+        assert not bad_backend.healthy
+        assert bad_backend.failures == SD_EJECT_AFTER_FAILURES
+        assert bad.requests == SD_EJECT_AFTER_FAILURES
+        assert pool.healthy_count() == 1
+
+        # Исключённый узел больше не получает запросов, даже когда его предпочли бы
+        for _ in range(3):
+            assert await request_avoiding(good.url)
+            assert await request_img2img(params())
+        assert bad.requests == SD_EJECT_AFTER_FAILURES
+        assert good.requests == 6
+    run_with_servers(test, monkeypatch)
+
+
+def test_success_resets_failure_count(monkeypatch):
+    async def test(pool, servers):
+        backend = pool.backends[0]
+        for _ in range(SD_EJECT_AFTER_FAILURES - 1):
+            pool.record_failure(backend)
+        assert backend.healthy
+        assert await request_img2img(params())
+        assert backend.failures == 0
+        pool.record_failure(backend)
+        assert backend.healthy
+    run_with_servers(test, monkeypatch, count=1)
+
+
+def test_health_loop_readmits_recovered_backend(monkeypatch):
+    async def test(pool, servers):
+        bad, good = servers
+        bad.healthy = False
+        pool.start()
+        # Проверка здоровья сама исключает узел, который не отвечает на SD_HEALTH_PATH
+        await wait_until(lambda: not pool.backends[0].healthy)
+        assert pool.backends[1].healthy
+
+        requests_before = bad.requests
+        for _ in range(3):
+            assert await request_avoiding(good.url)
+        assert bad.requests == requests_before
+
+        bad.healthy = True
+        await wait_until(lambda: pool.backends[0].healthy)
+        assert pool.backends[0].failures == 0
+        # Вернувшийся узел снова получает запросы
+        assert await request_avoiding(good.url)
+        assert bad.requests == requests_before + 1
+    run_with_servers(test, monkeypatch)
+
+
+def test_stopped_server_ejected_and_readmitted_after_restart(monkeypatch):
+    async def test(pool, servers):
+        server = servers[0]
+        await server.stop()
+        pool.start()
+        await wait_until(lambda: not pool.backends[0].healthy)
+        with pytest.raises(SDBackendError):
+            pool.pick()
+
+        restarted = StubSDServer(latency=0.01, jitter=0, port=server.port)
+        await restarted.start()
+        try:
+            await wait_until(lambda: pool.backends[0].healthy)
+            assert await request_img2img(params())
+            assert restarted.requests == 1
+        finally:
+            await restarted.stop()
+    run_with_servers(test, monkeypatch, count=1)
+
+
+def test_5xx_retried_on_other_node(monkeypatch):
+    async def test(pool, servers):
+        bad, good = servers
+        bad.error_rate = 1.0
+        # Первый запрос уходит на первый узел (нагрузка у узлов одинаковая)
+        assert await request_img2img(params())
+        assert (bad.requests, good.requests) == (1, 1)
+        assert pool.backends[0].failures == 1
+        assert pool.backends[1].failures == 0
+    run_with_servers(test, monkeypatch)
+
+
+def test_4xx_not_retried(monkeypatch):
+    async def test(pool, servers):
+        servers[0].error_rate = 1.0
+        servers[0].error_status = 400
+        with pytest.raises(SDRequestError):
+            await request_img2img(params())
+        assert servers[0].requests + servers[1].requests == 1
+        # Ошибка запроса, а не узла
+        assert pool.backends[0].failures == 0
+    run_with_servers(test, monkeypatch)
+
+
+def enable_hedging(monkeypatch, pool, delay: float):
+    monkeypatch.setattr(ai_processing, "SD_HEDGE_ENABLED", True)
+    monkeypatch.setattr(ai_processing, "SD_HEDGE_MIN_DELAY", delay)
+    # Быстрые замеры: задержку хеджа определяет SD_HEDGE_MIN_DELAY
+    pool.unit_samples.extend([1e-6] * ai_processing.SD_HEDGE_MIN_SAMPLES)
+
+
+def test_slow_primary_hedged_and_loser_cancelled(monkeypatch):
+    async def test(pool, servers):
+        slow, fast = servers
+        slow.latency = 1.5
+        enable_hedging(monkeypatch, pool, 0.1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert await request_img2img(params())
+        assert loop.time() - started < 1.0
+        assert (slow.requests, fast.requests) == (1, 1)
+        # Проигравший запрос отменён: слот узла свободен, ошибкой узла это не считается
+        assert ai_processing._hedges_in_flight == 0
+        assert [backend.in_flight for backend in pool.backends] == [0, 0]
+        assert pool.backends[0].failures == 0
+    run_with_servers(test, monkeypatch)
+
+
+def test_cancel_during_hedge_delay_cancels_primary(monkeypatch):
+    async def test(pool, servers):
+        servers[0].latency = 1.5
+        enable_hedging(monkeypatch, pool, 1.0)
+        request = asyncio.create_task(request_img2img(params()))
+        await wait_until(lambda: pool.backends[0].in_flight == 1)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        await wait_until(lambda: pool.backends[0].in_flight == 0, timeout=0.5)
+        assert servers[1].requests == 0
+        assert ai_processing._hedges_in_flight == 0
+    run_with_servers(test, monkeypatch)
+
+
+def test_deadline_timeout_not_counted_against_node(monkeypatch):
+    async def test(pool, servers):
+        servers[0].latency = 1.5
+        backend = pool.backends[0]
+        deadline = asyncio.get_running_loop().time() + 0.2
+        with pytest.raises((asyncio.TimeoutError, SDBackendError)):
+            await request_img2img(params(), deadline)
+        # Попытке досталось меньше SD_REQUEST_TIMEOUT — виноват срок задачи, а не узел
+        assert backend.failures == 0
+        assert backend.healthy
+
+        # Полный таймаут попытки — ошибка узла
+        monkeypatch.setattr(ai_processing, "SD_REQUEST_TIMEOUT", 0.2)
+        monkeypatch.setattr(ai_processing, "SD_RETRY_ATTEMPTS", 1)
+        with pytest.raises(asyncio.TimeoutError):
+            await request_img2img(params())
+        assert backend.failures == 1
+    run_with_servers(test, monkeypatch, count=1)
@@ -0,0 +1,169 @@
+"""RedisStateStore против заглушки Redis из бенчмарка и разбор RESP без сети"""
+import asyncio
+
+import pytest
+
+from benchmarks.stub_servers import StubRedisServer
+from state_store import MemoryStateStore, RedisStateStore, StateStoreError, _RedisConnection
+
+
+def run_with_redis(test, url_suffix: str = "", **kwargs):
+    async def main():
+        server = StubRedisServer()
+        await server.start()
+        url = f"redis://{url_suffix}{server.host}:{server.port}/2" if url_suffix else server.url
+        store = RedisStateStore(url, prefix="test:", **kwargs)
+        try:
+            await test(store, server)
+        finally:
+            await store.close()
+            await server.stop()
+    asyncio.run(main())
+
+
+class _Writer:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data: bytes):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+async def _reply(data: bytes):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return await _RedisConnection(reader, _Writer())._read_reply()
+
+
+def test_command_encoding():
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"+OK\r\n")
+        writer = _Writer()
+        assert await _RedisConnection(reader, writer).execute("SET", "ключ", b"\x00\r\n", 5) == "OK"
+        # Длина — в байтах, значение передаётся как есть, даже с \r\n внутри
+        assert writer.data == b"*4\r\n$3\r\nSET\r\n$8\r\n\xd0\xba\xd0\xbb\xd1\x8e\xd1\x87\r\n$3\r\n\x00\r\n\r\n$1\r\n5\r\n"
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"+PONG\r\n", "PONG"),
+    (b":42\r\n", 42),
+    (b"$5\r\nhe\r\no\r\n", b"he\r\no"),
+    (b"$0\r\n\r\n", b""),
+    (b"$-1\r\n", None),
+    (b"*-1\r\n", None),
+    (b"*3\r\n:1\r\n$1\r\na\r\n*1\r\n+x\r\n", [1, b"a", ["x"]]),
+])
+def test_reply_parsing(data, expected):
+    assert asyncio.run(_reply(data)) == expected
+
+
+def test_error_reply_is_returned_not_raised():
+    reply = asyncio.run(_reply(b"-ERR wrong type\r\n"))
+    assert isinstance(reply, StateStoreError)
+    assert str(reply) == "ERR wrong type"
+
+
+def test_unknown_reply_type():
+    with pytest.raises(ConnectionError):
+        asyncio.run(_reply(b"?what\r\n"))
+
+
+def test_get_set_delete():
+    async def test(store, server):
+        assert await store.get("missing") is None
+        await store.set("user:1", {"uploads": ["a", "b"], "name": "Тест"})
+        assert await store.get("user:1") == {"uploads": ["a", "b"], "name": "Тест"}
+        # Ключи пишутся с префиксом
+        assert b"test:user:1" in server._data
+        await store.set("user:2", {})
+        await store.delete("user:1", "user:2", "missing")
+        assert await store.get("user:1") is None
+        assert await store.get("user:2") is None
+    run_with_redis(test)
+
+
+def test_ttl_expires_keys():
+    async def test(store, server):
+        await store.set("short", {"v": 1}, ttl=1)
+        await store.set("forever", {"v": 2})
+        assert server._data[b"test:forever"][1] is None
+        assert await store.get("short") == {"v": 1}
+        await asyncio.sleep(1.1)
+        assert await store.get("short") is None
+        assert await store.get("forever") == {"v": 2}
+    run_with_redis(test)
+
+
+def test_set_if_absent():
+    async def test(store, server):
+        assert await store.set_if_absent("lock", {"owner": 1}, ttl=60)
+        assert not await store.set_if_absent("lock", {"owner": 2}, ttl=60)
+        assert await store.get("lock") == {"owner": 1}
+        await store.delete("lock")
+        assert await store.set_if_absent("lock", {"owner": 2})
+    run_with_redis(test)
+
+
+def test_auth_and_database_selected_on_connect():
+    async def test(store, server):
+        await store.ping()
+        await store.ping()
+        assert server.commands["AUTH"] == 1
+        assert server.commands["SELECT"] == 1
+        assert server.connections == 1
+    run_with_redis(test, url_suffix=":secret@")
+
+
+def test_redis_error_keeps_connection():
+    async def test(store, server):
+        with pytest.raises(StateStoreError):
+            await store._execute("BOGUS")
+        await store.ping()
+        assert server.connections == 1
+    run_with_redis(test)
+
+
+def test_pool_size_limits_connections():
+    async def test(store, server):
+        await asyncio.gather(*(store.set(f"k{i}", {"i": i}) for i in range(20)))
+        assert server.connections <= 2
+        assert [await store.get(f"k{i}") for i in range(20)] == [{"i": i} for i in range(20)]
+    run_with_redis(test, pool_size=2)
+
+
+def test_reconnects_after_server_drops_connections():
+    async def test(store, server):
+        await store.set("key", {"v": 1})
+        server.drop_connections()
+        await asyncio.sleep(0.05)
+        # Закрытое соединение из пула заменяется новым без ошибки для вызывающего
+        assert await store.get("key") == {"v": 1}
+        assert server.connections == 2
+    run_with_redis(test)
+
+
+def test_connection_error_when_server_is_down():
+    async def test(store, server):
+        await server.stop()
+        with pytest.raises(OSError):
+            await store.ping()
+    run_with_redis(test)
+
+
+def test_memory_store_ttl_and_copies():
+    async def main():
+        store = MemoryStateStore()
+        await store.set("short", {"items": [1]}, ttl=0.05)
+        value = await store.get("short")
+        value["items"].append(2)
+        assert await store.get("short") == {"items": [1]}
+        await asyncio.sleep(0.1)
+        assert await store.get("short") is None
+        assert await store.set_if_absent("short", {})
+    asyncio.run(main())
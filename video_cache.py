@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, delete, func
+
+from models import VideoCache
+from session import async_session
+from ai_processing import generation_params, quality_profile
+from config import CACHE_ENABLED, CACHE_MAX_BYTES, FILE_LIFETIME_DAYS
+
+
+def make_cache_key(input_id: str, style: str, profile_name: Optional[str] = None) -> str:
+    """Ключ кэша: фото (file_unique_id) + стиль + параметры генерации (профиль качества)"""
+    payload = json.dumps(
+        {"input": input_id, "style": style.lower(), "params": generation_params(quality_profile(profile_name))},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def lookup(cache_key: str, session=None) -> Optional[VideoCache]:
+    """Поиск готового видео; запись без file_id и без файла на диске считается промахом.
+
+    session — открытая сессия вызывающего: тогда второе соединение из пула не
+    берётся, но lookup() делает commit этой сессии.
+    """
+    if not CACHE_ENABLED:
+        return None
+    if session is None:
+        async with async_session() as session:
+            return await lookup(cache_key, session)
+
+    cutoff = datetime.now() - timedelta(days=FILE_LIFETIME_DAYS)
+    result = await session.execute(select(VideoCache).where(VideoCache.cache_key == cache_key))
+    entry = result.scalar_one_or_none()
+    if not entry or entry.created_at < cutoff:
+        return None
+    if not entry.telegram_file_id and not (entry.result_path and os.path.exists(entry.result_path)):
+        return None
+
+    entry.last_used_at = datetime.now()
+    await session.commit()
+    return entry
+
+
+async def store(cache_key: str, result_path: str, telegram_file_id: Optional[str], session=None):
+    """Сохранение результата (повторная запись обновляет file_id); session — как в lookup()"""
+    if not CACHE_ENABLED:
+        return
+    if session is None:
+        async with async_session() as session:
+            return await store(cache_key, result_path, telegram_file_id, session)
+
+    size = os.path.getsize(result_path) if os.path.exists(result_path) else 0
+    result = await session.execute(select(VideoCache).where(VideoCache.cache_key == cache_key))
+    entry = result.scalar_one_or_none()
+    if not entry:
+        entry = VideoCache(cache_key=cache_key, created_at=datetime.now())
+        session.add(entry)
+    entry.result_path = result_path
+    entry.telegram_file_id = telegram_file_id or entry.telegram_file_id
+    entry.size_bytes = size
+    entry.last_used_at = datetime.now()
+    await session.commit()
+
+    await evict(session)
+
+
+def _remove_file(path: Optional[str]):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Не удалось удалить {path}: {e}")
+
+
+async def evict(session=None) -> int:
+    """Удаление записей старше FILE_LIFETIME_DAYS и самых давно использованных сверх CACHE_MAX_BYTES"""
+    if session is None:
+        async with async_session() as session:
+            return await evict(session)
+
+    removed = 0
+    cutoff = datetime.now() - timedelta(days=FILE_LIFETIME_DAYS)
+    # 1. По возрасту
+    result = await session.execute(select(VideoCache).where(VideoCache.created_at < cutoff))
+    expired = result.scalars().all()
+    for entry in expired:
+        _remove_file(entry.result_path)
+    if expired:
+        await session.execute(delete(VideoCache).where(VideoCache.id.in_([e.id for e in expired])))
+        removed += len(expired)
+
+    # 2. По размеру: сначала те, что дольше всего не запрашивались
+    total = await session.scalar(select(func.coalesce(func.sum(VideoCache.size_bytes), 0)))
+    if total > CACHE_MAX_BYTES:
+        result = await session.execute(
+            select(VideoCache).where(VideoCache.created_at >= cutoff).order_by(VideoCache.last_used_at)
+        )
+        for entry in result.scalars():
+            if total <= CACHE_MAX_BYTES:
+                break
+            _remove_file(entry.result_path)
+            total -= entry.size_bytes or 0
+            await session.delete(entry)
+            removed += 1
+
+    await session.commit()
+
+    if removed:
+        print(f"🧹 Из кэша видео удалено записей: {removed}")
+    return removed
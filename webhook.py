@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import hmac
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+import metrics
+from metrics import WEBHOOK_UPDATES_TOTAL, WEBHOOK_QUEUE_DEPTH
+from config import (
+    BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WEBHOOK_DRAIN_TIMEOUT, WEBHOOK_MAX_CONNECTIONS
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_secret() -> str:
+    """Секрет из конфига или производный от токена — одинаковый на всех экземплярах бота"""
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+
+
+class WebhookServer:
+    """Приём обновлений от Telegram через aiohttp вместо long polling.
+
+    Обработчик запроса только проверяет секрет и кладёт обновление в ограниченную
+    очередь, сразу отвечая 200; обновления обрабатывают WEBHOOK_WORKERS воркеров.
+    Если очередь переполнена, отвечаем 503 — Telegram повторит доставку позже
+    (возможно, на другой экземпляр за балансировщиком). При остановке сервер
+    перестаёт принимать запросы и ждёт, пока очередь обработается.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.secret = webhook_secret()
+        self._queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        self._workers = []
+        self._runner: Optional[web.AppRunner] = None
+        self._draining = False
+
+    async def collect_metrics(self):
+        WEBHOOK_QUEUE_DEPTH.set(self._queue.qsize())
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            WEBHOOK_UPDATES_TOTAL.inc(outcome="forbidden")
+            return web.Response(status=403)
+        if self._draining:
+            WEBHOOK_UPDATES_TOTAL.inc(outcome="rejected")
+            return web.Response(status=503)
+
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            print(f"Некорректное обновление от Telegram: {e}")
+            WEBHOOK_UPDATES_TOTAL.inc(outcome="invalid")
+            return web.Response(status=400)
+
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            WEBHOOK_UPDATES_TOTAL.inc(outcome="rejected")
+            return web.Response(status=503)
+
+        WEBHOOK_UPDATES_TOTAL.inc(outcome="accepted")
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Для балансировщика: 503, пока экземпляр выключается"""
+        return web.Response(status=503 if self._draining else 200, text=str(self._queue.qsize()))
+
+    async def _worker_loop(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                print(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def start(self):
+        for _ in range(WEBHOOK_WORKERS):
+            self._workers.append(asyncio.create_task(self._worker_loop()))
+        metrics.registry.add_collector(self.collect_metrics)
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+        if WEBHOOK_URL:
+            await self.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+        print(f"🌐 Webhook: http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    async def stop(self):
+        """Перестать принимать обновления и дообработать очередь.
+
+        Webhook в Telegram не удаляется: за балансировщиком могут работать другие экземпляры.
+        """
+        self._draining = True
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        try:
+            await asyncio.wait_for(self._queue.join(), WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Не успели обработать {self._queue.qsize()} обновлений при остановке")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()